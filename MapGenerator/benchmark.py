@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import platform
+import statistics
+import tempfile
+import itertools
+import tracemalloc
+from generator_import import *
+
+
+class Benchmark():
+	''' Times the map generation pipeline for a set of configurations '''
+
+	PHASES = ("arrange_racks", "generate_walls", "choose_start_points", "build_wrapper", "save_world")
+	# Regression is reported if the time grows more than this fraction
+	DEFAULT_TOLERANCE = 0.2
+	# Shorter phases are too noisy to be compared with the baseline
+	MIN_COMPARED_TIME = 0.001 # s
+
+
+	def __init__(self, seeds, save_path):
+		''' Initializes the benchmark which generates a map for each seed
+			and saves its fields to save_path '''
+
+		self._seeds = seeds
+		self._save_path = save_path
+
+
+	@staticmethod
+	def get_configuration_name(width, height, rack_number, wall_number):
+		''' Returns the name of the configuration used to match it with the baseline '''
+
+		return "{0}x{1} racks={2} walls={3}".format(width, height, \
+			"random" if rack_number is None else rack_number, \
+			"random" if wall_number is None else wall_number)
+
+
+	def _run_map(self, seed, width, height, rack_number, wall_number):
+		''' Generates the map for the seed and saves all its fields,
+			returns GeneratorMetrics of the map '''
+
+		metrics = GeneratorMetrics()
+		random_generator = random.Random(seed)
+		generator = MapGenerator(random_generator, width, height, rack_number, wall_number, metrics)
+
+		with metrics.measure("build_wrapper"):
+			wrapper = TRIKMapWrapper(random_generator, False, width, height)
+			for wall in generator.get_walls():
+				wrapper.add_wall(wall[0], wall[1])
+
+		with metrics.measure("save_world"):
+			template = wrapper.compile_world()
+			for i, point in enumerate(generator.get_new_start_point()):
+				template.save_world(os.path.join(self._save_path, "field_{0}.xml".format(i)), \
+					(point[0], point[1]), point[2])
+
+		return metrics
+
+
+	def _measure_peak_memory(self, width, height, rack_number, wall_number):
+		''' Returns peak memory allocated while generating the map for the first seed '''
+
+		tracemalloc.start()
+		try:
+			self._run_map(self._seeds[0], width, height, rack_number, wall_number)
+			return tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+
+
+	def run_configuration(self, width, height, rack_number=None, wall_number=None):
+		''' Returns the measurements for the maps of given configuration '''
+
+		phase_times = { phase: [] for phase in self.PHASES }
+
+		# Warming up caches and the allocator
+		self._run_map(self._seeds[0], width, height, rack_number, wall_number)
+
+		start_time = time.perf_counter()
+		for seed in self._seeds:
+			metrics = self._run_map(seed, width, height, rack_number, wall_number)
+
+			for phase in self.PHASES:
+				phase_times[phase].append(metrics.phase_times[phase])
+		total_time = time.perf_counter() - start_time
+
+		peak_memory = self._measure_peak_memory(width, height, rack_number, wall_number)
+
+		return {
+			"name": self.get_configuration_name(width, height, rack_number, wall_number),
+			"width": width,
+			"height": height,
+			"rack_number": rack_number,
+			"wall_number": wall_number,
+			"maps": len(self._seeds),
+			"maps_per_second": len(self._seeds) / total_time,
+			# Median is less affected by the maps which are generated much longer than usual
+			"phase_times": { phase: statistics.median(times) for phase, times in phase_times.items() },
+			"peak_memory": peak_memory
+		}
+
+
+	def run(self, sizes, rack_numbers, wall_numbers):
+		''' Runs every combination of map sizes, rack and wall numbers.
+			Rack and wall numbers are given for the 8x8 map and scaled to the area '''
+
+		results = []
+		for size, rack_number, wall_number in itertools.product(sizes, rack_numbers, wall_numbers):
+			scale = size * size / float(MapGenerator.MAP_SIZE * MapGenerator.MAP_SIZE)
+			result = self.run_configuration(size, size, \
+				None if rack_number is None else max(1, int(round(rack_number * scale))), \
+				None if wall_number is None else max(0, int(round(wall_number * scale))))
+
+			print("{0}: {1:.2f} maps/s, peak memory {2} KiB".format( \
+				result["name"], result["maps_per_second"], result["peak_memory"] // 1024))
+			results.append(result)
+
+		return {
+			"python": platform.python_version(),
+			"seeds": list(self._seeds),
+			"configurations": results
+		}
+
+
+def compare_with_baseline(results, baseline, tolerance):
+	''' Returns the list of regressions comparing to the baseline results '''
+
+	baseline_configurations = { result["name"]: result for result in baseline["configurations"] }
+
+	regressions = []
+	for result in results["configurations"]:
+		baseline_result = baseline_configurations.get(result["name"])
+		if baseline_result is None:
+			continue
+
+		measurements = [("maps/s", baseline_result["maps_per_second"] / result["maps_per_second"])]
+		for phase, phase_time in result["phase_times"].items():
+			baseline_time = baseline_result["phase_times"].get(phase)
+			if baseline_time is not None and baseline_time >= Benchmark.MIN_COMPARED_TIME:
+				measurements.append((phase, phase_time / baseline_time))
+
+		for measurement, slowdown in measurements:
+			if slowdown > 1 + tolerance:
+				regressions.append("{0}: {1} is {2:.0%} slower than the baseline".format( \
+					result["name"], measurement, slowdown - 1))
+
+	return regressions
+
+
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Measures the performance of the field generator")
+
+		parser.add_argument("--sizes", type=int, nargs="+", default=[8, 16, 32], metavar="N", help="map sizes in cells")
+		parser.add_argument("--racks", type=int, nargs="+", default=[None], metavar="R",
+			help="rack numbers for the 8x8 map (random by default)")
+		parser.add_argument("--walls", type=int, nargs="+", default=[None], metavar="W",
+			help="wall numbers for the 8x8 map (random by default)")
+		parser.add_argument("--seeds", type=int, default=20, metavar="N", help="number of maps per configuration")
+		parser.add_argument("--output", default=None, metavar="PATH", help="save results as JSON")
+		parser.add_argument("--baseline", default=None, metavar="PATH", help="compare results with the baseline")
+		parser.add_argument("--save-baseline", default=None, metavar="PATH", help="save results as the new baseline")
+		parser.add_argument("--tolerance", type=float, default=Benchmark.DEFAULT_TOLERANCE, metavar="T",
+			help="allowed slowdown comparing to the baseline")
+
+		return parser.parse_args(sys.argv[1:])
+
+
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+
+
+	def run(self):
+		arguments = self._parsed_arguments
+
+		with tempfile.TemporaryDirectory() as save_path:
+			benchmark = Benchmark(list(range(arguments.seeds)), save_path)
+			results = benchmark.run(arguments.sizes, arguments.racks, arguments.walls)
+
+		for path in (arguments.output, arguments.save_baseline):
+			if path is not None:
+				with open(path, "w") as results_file:
+					json.dump(results, results_file, indent=4)
+
+		if arguments.baseline is not None:
+			with open(arguments.baseline, "r") as baseline_file:
+				regressions = compare_with_baseline(results, json.load(baseline_file), arguments.tolerance)
+
+			for regression in regressions:
+				print(regression)
+			if regressions:
+				sys.exit(1)
+
+			print("No regressions comparing to the baseline")
+
+
+if __name__ == "__main__":
+	benchmark = Program()
+	benchmark.run()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from generator_import import *
+
+
+class ConstraintEvaluator():
+	''' Evaluates the events of the field for a robot standing in some point 
+		and showing some label, only the conditions used by TRIKMapWrapper 
+		are supported (inside, greater, equals, not) '''
+		
+	LABEL_NUMBER_STATE = "robot1.display.labels.size"
+	LABEL_TEXT_STATE = "robot1.display.labels.first.text"
+	
+	def __init__(self, data):
+		''' Initializes the evaluator for the field xml given as bytes '''
+		
+		root = xml.fromstring(data)
+		
+		self.regions = {}
+		for region in root.iter("region"):
+			self.regions[region.get("id")] = tuple(float(region.get(key)) for key in ("x", "y", "width", "height"))
+			
+		self.events = []
+		for event in root.iter("event"):
+			trigger = event.find("trigger")[0].tag
+			conditions = event.find("conditions")
+			self.events.append((trigger, self._compile_conditions(conditions)))
+			
+			
+	def _compile_conditions(self, element):
+		''' Returns the function of (point, labels) which evaluates the condition element '''
+		
+		if element.tag == "conditions":
+			parts = [self._compile_conditions(child) for child in element]
+			glue = all if element.get("glue", "and") == "and" else any
+			return lambda point, labels: glue(part(point, labels) for part in parts)
+			
+		if element.tag == "not":
+			part = self._compile_conditions(element[0])
+			return lambda point, labels: not part(point, labels)
+			
+		if element.tag == "inside":
+			x, y, width, height = self.regions[element.get("regionId")]
+			return lambda point, labels: x <= point[0] < x + width and y <= point[1] < y + height
+			
+		if element.tag in ("equals", "greater"):
+			first, second = [self._compile_value(child) for child in element]
+			if element.tag == "equals":
+				return lambda point, labels: first(labels) == second(labels)
+			return lambda point, labels: first(labels) is not None and first(labels) > second(labels)
+			
+		raise ValueError("Unsupported condition {0}".format(element.tag))
+		
+		
+	def _compile_value(self, element):
+		if element.tag == "objectState":
+			state = element.get("object")
+			if state == self.LABEL_NUMBER_STATE:
+				return lambda labels: len(labels)
+			if state == self.LABEL_TEXT_STATE:
+				return lambda labels: labels[0] if labels else None
+			raise ValueError("Unsupported object state {0}".format(state))
+			
+		if element.tag == "int":
+			value = int(element.get("value"))
+		elif element.tag == "string":
+			value = element.get("value")
+		else:
+			raise ValueError("Unsupported value {0}".format(element.tag))
+			
+		return lambda labels: value
+		
+		
+	def get_verdict(self, point, labels):
+		''' Returns "fail", "success" or None if no event is triggered '''
+		
+		triggers = set(trigger for trigger, condition in self.events if condition(point, labels))
+		
+		if "fail" in triggers:
+			return "fail"
+		if "success" in triggers:
+			return "success"
+		return None
+		
+		
+def compare_verdicts(full_data, compact_data, cells, labels):
+	''' Returns the list of (cell, label) for which the fields give different verdicts,
+		the robot stands in the centre of the cell and shows the label (or nothing) '''
+		
+	full_evaluator = ConstraintEvaluator(full_data)
+	compact_evaluator = ConstraintEvaluator(compact_data)
+	
+	mismatches = []
+	for x, y in cells:
+		point = ((x + 0.5) * TRIKMapWrapper.CELL_WIDTH, (y + 0.5) * TRIKMapWrapper.CELL_HEIGHT)
+		for label in [None] + labels:
+			shown_labels = [label] if label is not None else []
+			if full_evaluator.get_verdict(point, shown_labels) != compact_evaluator.get_verdict(point, shown_labels):
+				mismatches.append(((x, y), label))
+				
+	return mismatches
+	
+	
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Checks that compact constraints give the same verdicts as the full ones")
+		
+		parser.add_argument("--width", type=int, default=MapGenerator.MAP_SIZE, metavar="W", help="map width in cells")
+		parser.add_argument("--height", type=int, default=MapGenerator.MAP_SIZE, metavar="H", help="map height in cells")
+		parser.add_argument("--count", type=int, default=5, metavar="N", help="number of maps to check")
+		parser.add_argument("--seed", type=int, default=0, metavar="S", help="seed of the batch")
+		
+		return parser.parse_args(sys.argv[1:])
+		
+		
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+		
+		
+	def _render(self, generator, excluded_cells):
+		wrapper = TRIKMapWrapper(None, True, generator.get_size()[0], generator.get_size()[1], excluded_cells)
+		for wall in generator.get_walls():
+			wrapper.add_wall(wall[0], wall[1])
+			
+		point = next(generator.get_new_start_point())
+		return wrapper.compile_world().render((point[0], point[1]), point[2])
+		
+		
+	def run(self):
+		arguments = self._parsed_arguments
+		
+		all_cells = [(x, y) for x in range(arguments.width) for y in range(arguments.height)]
+		# Labels of all cells and one which is not a cell
+		labels = ["({0},{1})".format(x, y) for x, y in all_cells] + ["(-1,-1)"]
+		
+		sizes = [0, 0]
+		event_numbers = [0, 0]
+		mismatch_number = 0
+		for generator in iter_maps(arguments.seed, arguments.width, arguments.height, count=arguments.count):
+			racks = set(generator.get_racks())
+			full_data = self._render(generator, ())
+			compact_data = self._render(generator, racks)
+			
+			for i, data in enumerate((full_data, compact_data)):
+				sizes[i] += len(data)
+				event_numbers[i] += data.count(b"<event ")
+				
+			# The robot can not enter the racks, so only the other cells are compared
+			mismatches = compare_verdicts(full_data, compact_data, [cell for cell in all_cells if cell not in racks], labels)
+			for cell, label in mismatches[:3]:
+				print("Map {0}: verdicts differ in cell {1} with label {2}".format(generator.seed, cell, label))
+			mismatch_number += len(mismatches)
+			
+		print("Events per field: {0:.0f} -> {1:.0f}, field size: {2:.0f} -> {3:.0f} bytes".format( \
+			event_numbers[0] / float(arguments.count), event_numbers[1] / float(arguments.count), \
+			sizes[0] / float(arguments.count), sizes[1] / float(arguments.count)))
+		print("Checked {0} maps, different verdicts: {1}".format(arguments.count, mismatch_number))
+		
+		if mismatch_number != 0:
+			sys.exit(1)
+			
+			
+if __name__ == "__main__":
+	checker = Program()
+	checker.run()
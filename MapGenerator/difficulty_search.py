@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+import os
+from generator_import import *
+
+
+class DifficultyScore():
+	''' Difficulty of the map which is updated incrementally when a wall
+		between two free cells is added or removed.
+		
+		Difficulty is SIGNATURE_WEIGHT * probability that two random start poses 
+		have the same sensor signature - LOOP_WEIGHT * loops per free cell 
+		+ DEAD_END_WEIGHT * dead ends per free cell. The weights are heuristic and
+		only weakly follow the moves LocalizationSimulator needs: corridors of 
+		tree-like maps look alike, while open maps with loops show more distinct 
+		wall patterns '''
+		
+	SIGNATURE_WEIGHT = 10.0
+	LOOP_WEIGHT = 2.0
+	DEAD_END_WEIGHT = 1.0
+	
+	def __init__(self, board, racks):
+		''' Initializes the score of the board with the racks in the set of cells racks '''
+		
+		self._board = board
+		self._free_cells = [(x, y) for x in range(board.width) for y in range(board.height) if (x, y) not in racks]
+		self._free_cell_set = set(self._free_cells)
+		
+		# Walls between two free cells, the others (border, racks) are never changed
+		self.edge_ids = []
+		for x, y in self._free_cells:
+			for neighbour in ((x + 1, y), (x, y + 1)):
+				if neighbour in self._free_cell_set:
+					self.edge_ids.append(self._get_edge_id((x, y), neighbour))
+					
+		self._degrees = { cell: len(self.get_open_neighbours(cell)) for cell in self._free_cells }
+		self.open_edge_number = sum(self._degrees.values()) // 2
+		self.dead_end_number = sum(1 for degree in self._degrees.values() if degree == 1)
+		
+		self._signatures = {}
+		self._signature_numbers = collections.Counter()
+		for x, y in self._free_cells:
+			for direction in SensorSignatureIndex.DIRECTIONS:
+				signature = SensorSignatureIndex.get_pose_signature(board, (x, y, direction))
+				self._signatures[(x, y, direction)] = signature
+				self._signature_numbers[signature] += 1
+				
+		self._signature_square_sum = sum(number * number for number in self._signature_numbers.values())
+		
+		
+	def _get_edge_id(self, cell, neighbour):
+		''' Returns the id of the segment between the cell and the next cell along x or y '''
+		
+		x, y = cell
+		board = self._board
+		if neighbour == (x + 1, y):
+			return board.get_edge_id(board.get_node_id(x + 1, y), board.get_node_id(x + 1, y + 1))
+			
+		return board.get_edge_id(board.get_node_id(x, y + 1), board.get_node_id(x + 1, y + 1))
+		
+		
+	def get_edge_cells(self, edge_id):
+		''' Returns 2 cells separated by the segment '''
+		
+		(i, j), (next_i, next_j) = self._board.get_wall_nodes(edge_id)
+		if j == next_j:
+			return ((i, j - 1), (i, j))
+			
+		return ((i - 1, j), (i, j))
+		
+		
+	def get_open_neighbours(self, cell):
+		x, y = cell
+		return [neighbour for neighbour, direction in (((x + 1, y), 0), ((x, y + 1), 90), ((x - 1, y), 180), ((x, y - 1), -90)) \
+			if neighbour in self._free_cell_set and not SensorSignatureIndex.has_wall(self._board, x, y, direction)]
+			
+			
+	def get_loop_number(self):
+		''' Returns the number of independent loops of the free cells (they are connected) '''
+		
+		return self.open_edge_number - len(self._free_cells) + 1
+		
+		
+	def get_signature_collision_probability(self):
+		pose_number = len(self._signatures)
+		return self._signature_square_sum / float(pose_number * pose_number)
+		
+		
+	def get_difficulty(self):
+		free_cell_number = float(len(self._free_cells))
+		
+		return self.SIGNATURE_WEIGHT * self.get_signature_collision_probability() - \
+			self.LOOP_WEIGHT * self.get_loop_number() / free_cell_number + \
+			self.DEAD_END_WEIGHT * self.dead_end_number / free_cell_number
+			
+			
+	def can_toggle(self, edge_id):
+		''' Checks if the free cells stay connected after toggling the wall. Searches grow
+			from both cells of the wall, the one with the smaller frontier first, so adding
+			a wall costs the shorter detour or the smaller cut off part, not the whole map '''
+		
+		if self._board.has_wall(edge_id):
+			return True
+			
+		# The new wall must not be the only path between the cells
+		start, finish = self.get_edge_cells(edge_id)
+		used = [{ start }, { finish }]
+		frontiers = [[start], [finish]]
+		while frontiers[0] and frontiers[1]:
+			side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+			next_frontier = []
+			for cell in frontiers[side]:
+				for neighbour in self.get_open_neighbours(cell):
+					if (cell, neighbour) in ((start, finish), (finish, start)):
+						continue
+					if neighbour in used[1 - side]:
+						return True
+					if neighbour not in used[side]:
+						used[side].add(neighbour)
+						next_frontier.append(neighbour)
+						
+			frontiers[side] = next_frontier
+			
+		return False
+		
+		
+	def toggle(self, edge_id):
+		''' Adds the wall if it is missing and removes it otherwise,
+			only the poses and degrees of 2 adjacent cells are updated '''
+			
+		cells = self.get_edge_cells(edge_id)
+		if self._board.has_wall(edge_id):
+			self._board.remove_wall(edge_id)
+			degree_change = 1
+		else:
+			self._board.add_wall(edge_id)
+			degree_change = -1
+			
+		self.open_edge_number += degree_change
+		for cell in cells:
+			degree = self._degrees[cell]
+			self.dead_end_number += (degree + degree_change == 1) - (degree == 1)
+			self._degrees[cell] = degree + degree_change
+			
+			for direction in SensorSignatureIndex.DIRECTIONS:
+				pose = (cell[0], cell[1], direction)
+				old_signature = self._signatures[pose]
+				new_signature = SensorSignatureIndex.get_pose_signature(self._board, pose)
+				if old_signature == new_signature:
+					continue
+					
+				# (n - 1)^2 - n^2 = 1 - 2n and (n + 1)^2 - n^2 = 2n + 1
+				self._signature_square_sum += 1 - 2 * self._signature_numbers[old_signature]
+				self._signature_numbers[old_signature] -= 1
+				self._signature_square_sum += 2 * self._signature_numbers[new_signature] + 1
+				self._signature_numbers[new_signature] += 1
+				self._signatures[pose] = new_signature
+				
+				
+class DifficultyMapGenerator(MapGenerator):
+	''' Map generator which anneals the walls of the generated map until 
+		its difficulty is within tolerance of the target difficulty '''
+		
+	INITIAL_TEMPERATURE = 0.05
+	COOLING_RATE = 0.998
+	MAX_STEPS = 5000
+	
+	def __init__(self, target_difficulty, tolerance, random_generator=None, width=MapGenerator.MAP_SIZE, \
+			height=MapGenerator.MAP_SIZE, rack_number=None, wall_number=None, metrics=None, max_steps=MAX_STEPS):
+		self.target_difficulty = target_difficulty
+		self.tolerance = tolerance
+		self.max_steps = max_steps
+		self.difficulty = None
+		self.steps = 0
+		
+		super().__init__(random_generator, width, height, rack_number, wall_number, metrics)
+		
+		
+	def is_in_band(self):
+		return abs(self.difficulty - self.target_difficulty) <= self.tolerance
+		
+		
+	def _search_difficulty(self, racks):
+		''' Toggles random walls between free cells keeping them connected, 
+			the moves are accepted by the simulated annealing rule '''
+			
+		score = DifficultyScore(self._board, racks)
+		self.difficulty = score.get_difficulty()
+		if not score.edge_ids:
+			return
+			
+		energy = abs(self.difficulty - self.target_difficulty)
+		temperature = self.INITIAL_TEMPERATURE
+		while energy > self.tolerance and self.steps < self.max_steps:
+			self.steps += 1
+			temperature *= self.COOLING_RATE
+			
+			edge_id = self._random.choice(score.edge_ids)
+			if not score.can_toggle(edge_id):
+				self._count("disconnecting_moves")
+				continue
+				
+			score.toggle(edge_id)
+			difficulty = score.get_difficulty()
+			new_energy = abs(difficulty - self.target_difficulty)
+			
+			if new_energy <= energy or self._random.random() < math.exp((energy - new_energy) / temperature):
+				self.difficulty = difficulty
+				energy = new_energy
+			else:
+				score.toggle(edge_id)
+				self._count("rejected_moves")
+				
+				
+	def _choose_start_points(self, restricted_cells):
+		''' Start points are chosen on the map with the searched walls '''
+		
+		with self._measure("search_difficulty"):
+			self._search_difficulty(restricted_cells)
+			
+		super()._choose_start_points(restricted_cells)
+		
+		
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Generates fields with the difficulty in the given band")
+		
+		parser.add_argument("path", nargs="?", default=".", metavar="PATH", help="save path")
+		parser.add_argument("--width", type=int, default=MapGenerator.MAP_SIZE, metavar="W", help="map width in cells")
+		parser.add_argument("--height", type=int, default=MapGenerator.MAP_SIZE, metavar="H", help="map height in cells")
+		parser.add_argument("--count", type=int, default=1, metavar="N", help="number of maps to generate")
+		parser.add_argument("--seed", type=int, default=0, metavar="S", help="seed of the batch")
+		parser.add_argument("--target", type=float, default=None, metavar="D", 
+			help="target difficulty, if not set the difficulty of generated maps is printed")
+		parser.add_argument("--tolerance", type=float, default=0.01, metavar="T", help="allowed difference from the target")
+		parser.add_argument("--max-steps", type=int, default=DifficultyMapGenerator.MAX_STEPS, metavar="K", 
+			help="number of annealing steps per map")
+		parser.add_argument("--max-attempts", type=int, default=None, metavar="M", 
+			help="number of maps to try (10 times --count by default)")
+		parser.add_argument("--deterministic-ids", default=False, action="store_true", 
+			help="if set, element ids are derived from the content")
+		
+		return parser.parse_args(sys.argv[1:])
+		
+		
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+		
+		
+	def _print_difficulty(self):
+		''' Prints quantiles of the difficulty of the maps without the search '''
+		
+		arguments = self._parsed_arguments
+		difficulties = sorted(DifficultyScore(generator.get_board(), set(generator.get_racks())).get_difficulty() \
+			for generator in iter_maps(arguments.seed, arguments.width, arguments.height, count=arguments.count))
+			
+		quantiles = ", ".join("{0}%: {1:.3f}".format(percent, difficulties[(len(difficulties) - 1) * percent // 100]) \
+			for percent in (0, 5, 25, 50, 75, 95, 100))
+		print("Difficulty of {0} maps: {1}".format(len(difficulties), quantiles))
+		
+		
+	def _save_fields(self, generator, map_index):
+		arguments = self._parsed_arguments
+		
+		random_generator = random.Random(generator.seed)
+		wrapper = TRIKMapWrapper(random_generator, arguments.deterministic_ids, arguments.width, arguments.height)
+		for wall in generator.get_walls():
+			wrapper.add_wall(wall[0], wall[1])
+			
+		template = wrapper.compile_world()
+		for i, point in enumerate(generator.get_new_start_point()):
+			template.save_world(os.path.join(arguments.path, "field_{0}_{1}.xml".format(map_index, i)), \
+				(point[0], point[1]), point[2])
+				
+				
+	def run(self):
+		arguments = self._parsed_arguments
+		if arguments.target is None:
+			self._print_difficulty()
+			return
+			
+		max_attempts = arguments.max_attempts if arguments.max_attempts is not None else 10 * arguments.count
+		
+		map_number = 0
+		attempt_number = 0
+		steps = 0
+		for map_index in range(max_attempts):
+			if map_number == arguments.count:
+				break
+				
+			attempt_number += 1
+			map_seed = get_map_seed(arguments.seed, map_index)
+			generator = DifficultyMapGenerator(arguments.target, arguments.tolerance, random.Random(map_seed), \
+				arguments.width, arguments.height, max_steps=arguments.max_steps)
+			generator.seed = map_seed
+			steps += generator.steps
+			
+			if generator.is_in_band():
+				self._save_fields(generator, map_number)
+				map_number += 1
+				
+		print("Generated {0} maps with difficulty {1:.3f} +- {2:.3f}, tried {3} maps, {4:.0f} steps per map".format( \
+			map_number, arguments.target, arguments.tolerance, attempt_number, steps / float(max(1, attempt_number))))
+			
+		if map_number < arguments.count:
+			sys.exit(1)
+			
+			
+if __name__ == "__main__":
+	search = Program()
+	search.run()
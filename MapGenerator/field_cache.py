@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import tempfile
+
+class FieldCache():
+	''' Size-bounded on-disk store of generated fields addressed by 
+		the hash of their content, least recently used fields are evicted first '''
+		
+	FIELD_EXTENSION = ".xml"
+	# Part of the limit which stays occupied after the eviction
+	EVICTION_TARGET = 0.9
+	
+	def __init__(self, path, max_size):
+		''' Initializes the cache in the folder path which 
+			holds at most max_size bytes '''
+			
+		self._path = path
+		self._max_size = max_size
+		# Computed on the first store
+		self._size = None
+		
+		os.makedirs(path, exist_ok=True)
+		
+		
+	@staticmethod
+	def get_map_key(walls, constraint_parameters):
+		''' Returns canonical hash of the map with given walls=[((x1, y1), (x2, y2))] '''
+		
+		canonical_walls = sorted(tuple(sorted((tuple(wall[0]), tuple(wall[1])))) for wall in walls)
+		
+		map_hash = hashlib.sha256()
+		map_hash.update(repr(tuple(constraint_parameters)).encode("utf8"))
+		for wall in canonical_walls:
+			map_hash.update("{0}:{1}:{2}:{3};".format( \
+				wall[0][0], wall[0][1], wall[1][0], wall[1][1]).encode("ascii"))
+			
+		return map_hash.hexdigest()
+		
+		
+	@staticmethod
+	def get_field_key(map_key, point, direction, time_limit=None):
+		''' Returns canonical hash of the map with given start point 
+			and time limit (if it is not the default one) '''
+		
+		key = "{0}/{1}:{2}:{3}".format(map_key, point[0], point[1], direction)
+		if time_limit is not None:
+			key += ":{0}".format(time_limit)
+			
+		return hashlib.sha256(key.encode("ascii")).hexdigest()
+			
+			
+	def _get_field_path(self, key):
+		return os.path.join(self._path, key[:2], key + self.FIELD_EXTENSION)
+		
+		
+	def _list_fields(self):
+		''' Returns (last access time, size, path) for each stored field '''
+		
+		fields = []
+		for folder in os.scandir(self._path):
+			if not folder.is_dir():
+				continue
+				
+			for entry in os.scandir(folder.path):
+				if not entry.name.endswith(self.FIELD_EXTENSION):
+					continue
+					
+				try:
+					stat = entry.stat()
+				except FileNotFoundError:
+					# Evicted by another process
+					continue
+					
+				fields.append((stat.st_mtime, stat.st_size, entry.path))
+				
+		return fields
+		
+		
+	def _evict(self):
+		''' Removes least recently used fields until the cache fits its limit '''
+		
+		fields = self._list_fields()
+		fields.sort()
+		
+		self._size = sum(size for access_time, size, path in fields)
+		target_size = self._max_size * self.EVICTION_TARGET
+		for access_time, size, path in fields:
+			if self._size <= target_size:
+				break
+				
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+				
+			self._size -= size
+			
+			
+	def get(self, key):
+		''' Returns the stored field or None if it is missing '''
+		
+		path = self._get_field_path(key)
+		try:
+			with open(path, "rb") as field_file:
+				data = field_file.read()
+				
+			# Modification time is used as the last access time
+			os.utime(path)
+		except FileNotFoundError:
+			return None
+			
+		return data
+		
+		
+	def put(self, key, data):
+		''' Stores the field with given key '''
+		
+		if len(data) > self._max_size:
+			return
+			
+		if self._size is None:
+			self._size = sum(size for access_time, size, path in self._list_fields())
+			
+		path = self._get_field_path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		
+		# The field appears atomically for concurrent readers
+		file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+		with os.fdopen(file_descriptor, "wb") as field_file:
+			field_file.write(data)
+			
+		# Overwritten field with the same key is not counted twice
+		try:
+			self._size -= os.stat(path).st_size
+		except FileNotFoundError:
+			pass
+		os.replace(temporary_path, path)
+		
+		self._size += len(data)
+		if self._size > self._max_size:
+			self._evict()
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import os
+import multiprocessing
+from generator_import import *
+
+
+class FieldImporter():
+	''' Reads the walls of a TRIK Studio field into MapRepresentation.
+	
+		Walls are snapped to the closest grid line if they deviate from it
+		by at most SNAP_TOLERANCE of the cell, parts outside the grid are dropped.
+		A unit segment of the grid becomes a wall if the walls cover at least
+		COVERAGE_THRESHOLD of it, so split walls like 200:1400-350:1400 and 
+		350:1400-400:1400 give one segment '''
+		
+	CELL_WIDTH = TRIKMapWrapper.CELL_WIDTH
+	CELL_HEIGHT = TRIKMapWrapper.CELL_HEIGHT
+	
+	SNAP_TOLERANCE = 0.1
+	COVERAGE_THRESHOLD = 0.5
+	
+	CELL_REGION_ID = re.compile(r"^\((\d+),(\d+)\)$")
+	
+	def __init__(self, path, width=None, height=None):
+		''' Imports the field, grid size is taken from the cell regions 
+			if width and height are not given '''
+			
+		self.path = path
+		self.start_point = None
+		self.skipped_wall_number = 0
+		
+		walls = []
+		cell_number = (0, 0)
+		
+		# Elements are dropped right after reading to keep the memory constant,
+		# constraints (the largest part of generated fields) are not needed
+		for event, element in xml.iterparse(path, events=("start", "end")):
+			if event == "start":
+				if element.tag == "constraints":
+					break
+				continue
+				
+			if element.tag == "wall":
+				walls.append((self._parse_point(element.get("begin")), self._parse_point(element.get("end"))))
+			elif element.tag == "region":
+				match = self.CELL_REGION_ID.match(element.get("id", ""))
+				if match:
+					cell_number = (max(cell_number[0], int(match.group(1)) + 1), \
+						max(cell_number[1], int(match.group(2)) + 1))
+			elif element.tag == "startPosition":
+				self.start_point = (int(float(element.get("x")) // self.CELL_WIDTH), \
+					int(float(element.get("y")) // self.CELL_HEIGHT), int(float(element.get("direction"))))
+			else:
+				continue
+				
+			element.clear()
+			
+		if width is None or height is None:
+			if cell_number == (0, 0):
+				raise ValueError("{0}: grid size is not given and there are no cell regions".format(path))
+			width, height = self._extend_size_to_racks(walls, *cell_number)
+			
+		self.board = MapRepresentation(width, height)
+		self._add_walls(walls)
+		
+		
+	@staticmethod
+	def _parse_point(point):
+		x, y = point.split(":")
+		return (float(x), float(y))
+		
+		
+	def _snap(self, coordinate, cell_length):
+		''' Returns the index of the grid line close to the coordinate or None '''
+		
+		line = int(round(coordinate / cell_length))
+		if abs(coordinate - line * cell_length) > self.SNAP_TOLERANCE * cell_length:
+			return None
+			
+		return line
+		
+		
+	def _get_covered_segments(self, walls, width=None, height=None):
+		''' Returns the set of (is horizontal, grid line, segment index) covered by the walls 
+			and the number of walls which are not on the grid, the grid is not bounded 
+			if width and height are not given '''
+		
+		# (is horizontal, grid line, segment index) -> covered intervals
+		coverage = collections.defaultdict(list)
+		skipped_wall_number = 0
+		
+		for begin, end in walls:
+			horizontal_line = self._snap(begin[1], self.CELL_HEIGHT)
+			vertical_line = self._snap(begin[0], self.CELL_WIDTH)
+			
+			if horizontal_line is not None and self._snap(end[1], self.CELL_HEIGHT) == horizontal_line and \
+					0 <= horizontal_line and (height is None or horizontal_line <= height):
+				key, line, interval, cell_length, segment_number = \
+					True, horizontal_line, sorted((begin[0], end[0])), self.CELL_WIDTH, width
+			elif vertical_line is not None and self._snap(end[0], self.CELL_WIDTH) == vertical_line and \
+					0 <= vertical_line and (width is None or vertical_line <= width):
+				key, line, interval, cell_length, segment_number = \
+					False, vertical_line, sorted((begin[1], end[1])), self.CELL_HEIGHT, height
+			else:
+				skipped_wall_number += 1
+				continue
+				
+			first_segment = max(0, int(interval[0] // cell_length))
+			last_segment = int(interval[1] // cell_length)
+			if segment_number is not None:
+				last_segment = min(segment_number - 1, last_segment)
+			for segment in range(first_segment, last_segment + 1):
+				segment_begin = max(interval[0], segment * cell_length)
+				segment_end = min(interval[1], (segment + 1) * cell_length)
+				if segment_begin < segment_end:
+					coverage[(key, line, segment)].append((segment_begin, segment_end))
+					
+		segments = set()
+		for (is_horizontal, line, segment), intervals in coverage.items():
+			cell_length = self.CELL_WIDTH if is_horizontal else self.CELL_HEIGHT
+			
+			covered_length = 0
+			covered_end = segment * cell_length
+			for begin, end in sorted(intervals):
+				covered_length += max(0, end - max(begin, covered_end))
+				covered_end = max(covered_end, end)
+				
+			if covered_length >= self.COVERAGE_THRESHOLD * cell_length:
+				segments.add((is_horizontal, line, segment))
+				
+		return segments, skipped_wall_number
+		
+		
+	def _extend_size_to_racks(self, walls, width, height):
+		''' Returns the grid size extended over the columns and rows after the cell regions 
+			which consist of racks only, compact fields have no regions in the rack cells '''
+		
+		segments, _ = self._get_covered_segments(walls)
+		
+		def is_rack(x, y):
+			return (True, y, x) in segments and (True, y + 1, x) in segments and \
+				(False, x, y) in segments and (False, x + 1, y) in segments
+				
+		is_extended = True
+		while is_extended:
+			is_extended = False
+			if all(is_rack(width, y) for y in range(height)):
+				width += 1
+				is_extended = True
+			if all(is_rack(x, height) for x in range(width)):
+				height += 1
+				is_extended = True
+				
+		return width, height
+		
+		
+	def _add_walls(self, walls):
+		segments, self.skipped_wall_number = self._get_covered_segments(walls, self.board.width, self.board.height)
+		
+		for is_horizontal, line, segment in segments:
+			if is_horizontal:
+				first_node, second_node = (segment, line), (segment + 1, line)
+			else:
+				first_node, second_node = (line, segment), (line, segment + 1)
+				
+			self.board.add_wall(self.board.get_edge_id( \
+				self.board.get_node_id(*first_node), self.board.get_node_id(*second_node)))
+				
+				
+	def get_racks(self):
+		''' Returns the cells closed by the walls from all sides '''
+		
+		return { (x, y) for x in range(self.board.width) for y in range(self.board.height) \
+			if all(SensorSignatureIndex.has_wall(self.board, x, y, direction) \
+				for direction in SensorSignatureIndex.DIRECTIONS) }
+				
+				
+	def get_input_map(self):
+		''' Returns (2 * height + 1) x (2 * width + 1) matrix used by the solutions:
+			1 marks walls and the grid nodes touched by them, rows go along y '''
+			
+		board = self.board
+		matrix = [[0] * (2 * board.width + 1) for _ in range(2 * board.height + 1)]
+		
+		for edge_id in board.iter_wall_ids():
+			(first_x, first_y), (second_x, second_y) = board.get_wall_nodes(edge_id)
+			
+			matrix[2 * first_y][2 * first_x] = 1
+			matrix[2 * second_y][2 * second_x] = 1
+			matrix[first_y + second_y][first_x + second_x] = 1
+			
+		return matrix
+		
+		
+	def format_input_map(self):
+		''' Returns the matrix as the input_map declaration of the solution script '''
+		
+		rows = ["\t\t\t[{0}]".format(", ".join(str(value) for value in row)) for row in self.get_input_map()]
+		
+		return "var input_map =\n\t\t[\n{0}\n\t\t]\n".format(",\n".join(rows))
+		
+		
+def import_field(task):
+	''' Converts the field to the input_map file, returns (path, error) '''
+	
+	path, save_path, options = task
+	
+	try:
+		importer = FieldImporter(path, options.width, options.height)
+	except (xml.ParseError, ValueError, AttributeError) as error:
+		return (path, str(error))
+		
+	with open(save_path, "w") as map_file:
+		map_file.write(importer.format_input_map())
+		
+	return (path, None)
+	
+	
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Converts TRIK Studio fields to input_map matrices")
+		
+		parser.add_argument("paths", nargs="+", metavar="PATH", help="field files or folders with the fields")
+		parser.add_argument("--output", default=".", metavar="OUTPUT_PATH", help="folder for the matrices")
+		parser.add_argument("--width", type=int, default=None, metavar="W", help="map width in cells (from the regions by default)")
+		parser.add_argument("--height", type=int, default=None, metavar="H", help="map height in cells (from the regions by default)")
+		parser.add_argument("--jobs", type=int, default=1, metavar="J", help="number of worker processes")
+		
+		return parser.parse_args(sys.argv[1:])
+		
+		
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+		
+		
+	def _get_tasks(self):
+		options = self._parsed_arguments
+		
+		for path in options.paths:
+			if os.path.isdir(path):
+				field_paths = (os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".xml"))
+			else:
+				field_paths = (path,)
+				
+			for field_path in field_paths:
+				save_path = os.path.join(options.output, os.path.splitext(os.path.basename(field_path))[0] + ".txt")
+				yield (field_path, save_path, options)
+				
+				
+	def run(self):
+		os.makedirs(self._parsed_arguments.output, exist_ok=True)
+		jobs = self._parsed_arguments.jobs
+		
+		if jobs <= 1:
+			results = map(import_field, self._get_tasks())
+		else:
+			pool = multiprocessing.Pool(jobs)
+			results = pool.imap_unordered(import_field, self._get_tasks(), chunksize=16)
+			
+		field_number = 0
+		error_number = 0
+		for path, error in results:
+			field_number += 1
+			if error is not None:
+				error_number += 1
+				print("Field {0} is not converted: {1}".format(path, error))
+				
+		if jobs > 1:
+			pool.close()
+			pool.join()
+			
+		print("Converted {0} fields".format(field_number - error_number))
+		
+		
+if __name__ == "__main__":
+	importer = Program()
+	importer.run()
@@ -1,56 +1,389 @@
 # -*- coding: utf-8 -*-
-from generator_module import *
+import os
+import json
+import cProfile
+import contextlib
+import multiprocessing
+from generator_import import *
+from field_cache import FieldCache
+from localization_simulator import LocalizationSimulator
+from map_corpus import MapCorpus, MapCorpusWriter
+from map_dedup import MapSymmetry, DedupIndex
 
+# Field cache of the current process
+_field_cache = None
+
+def get_field_cache(options):
+	''' Returns the field cache of the current process or None if it is disabled '''
+	
+	global _field_cache
+	if options.cache is not None and _field_cache is None:
+		_field_cache = FieldCache(options.cache, options.cache_size * 1024 * 1024)
+		
+	return _field_cache
+	
+	
+def write_field(save_path, data):
+	with open(save_path, "wb") as field_file:
+		field_file.write(data)
+		
+	return len(data)
+	
+		
+def get_start_points(generator, options, point_indices=None):
+	''' Returns the start points of the fields, only the points 
+		with given indices are left if point_indices is set '''
+		
+	points = list(generator.get_new_start_point())
+	if options.localizable_only:
+		simulator = LocalizationSimulator(generator.get_board(), generator.get_racks())
+		points = [point for point in points if simulator.is_localizable(point)]
+		
+	if options.single:
+		points = points[:1]
+	if point_indices is not None:
+		points = [points[i] for i in point_indices]
+		
+	return points
+	
+	
+# Symmetries of the maps in the current process
+_map_symmetry = None
+
+def get_point_keys(task):
+	''' Generates the map and returns the keys of its (map, start point) pairs,
+		pairs which differ only by rotation or reflection get the same key.
+		The generated map and its metrics are returned too, so run_task() does not
+		generate the map again '''
+		
+	global _map_symmetry
+	map_index, map_seed, options, point_indices, _ = task
+	
+	if _map_symmetry is None:
+		_map_symmetry = MapSymmetry(options.width, options.height)
+		
+	metrics = GeneratorMetrics() if options.profile is not None else None
+	with profile_process(options):
+		generator = MapGenerator.from_seed(map_seed, options.width, options.height, metrics=metrics)
+		points = get_start_points(generator, options, point_indices)
+		keys = _map_symmetry.get_pose_keys(generator.get_board(), generator.get_racks(), points)
+		
+	return (map_index, map_seed, keys, (generator, metrics))
+	
+	
+def get_generator(task, metrics=None):
+	''' Returns the generator of the task map, the map is generated unless the task carries it '''
+	
+	map_index, map_seed, options, point_indices, generated_map = task
+	if generated_map is not None:
+		return generated_map[0]
+		
+	return MapGenerator.from_seed(map_seed, options.width, options.height, metrics=metrics)
+	
+	
+def generate_map_record(task, metrics=None):
+	''' Generates the map with given index and returns its corpus record '''
+	
+	map_index, map_seed, options, point_indices, _ = task
+	
+	generator = get_generator(task, metrics)
+	points = get_start_points(generator, options, point_indices)
+	
+	return MapCorpus.encode_record(options.width, options.height, MapGenerator.START_POINT_NUMBER, \
+		generator.seed, generator.get_board(), generator.get_racks(), points)
+		
+		
+def generate_map_fields(task, metrics=None):
+	''' Generates the map with given index and writes its fields,
+		returns the number of written fields '''
+		
+	map_index, map_seed, options, point_indices, _ = task
+	
+	generator = get_generator(task, metrics)
+	# Element ids are drawn from the same sequence after the map
+	random_generator = generator.get_random_generator()
+	walls = list(generator.get_walls())
+	
+	points = get_start_points(generator, options, point_indices)
+	
+	time_limits = [None] * len(points)
+	if options.adaptive_time_limit:
+		simulator = LocalizationSimulator(generator.get_board(), generator.get_racks())
+		time_limits = [TRIKMapWrapper.get_time_limit(simulator.get_exploration_moves(point), \
+			options.time_limit_slack) for point in points]
+			
+	field_name = "field_{0}".format(map_index) if options.count > 1 else "field"
+	if options.single:
+		save_paths = ["{0}/{1}.xml".format(options.path, field_name)]
+	else:
+		save_paths = ["{0}/{1}_{2}.xml".format(options.path, field_name, i) for i in range(len(points))]
+		
+	# Fields which are already stored in the cache are not rebuilt
+	cache = get_field_cache(options)
+	field_keys = [None] * len(points)
+	if cache is not None:
+		map_key = FieldCache.get_map_key(walls, \
+			TRIKMapWrapper.get_constraint_parameters(options.width, options.height, options.compact_constraints))
+		field_keys = [FieldCache.get_field_key(map_key, (point[0], point[1]), point[2], time_limit) \
+			for point, time_limit in zip(points, time_limits)]
+		
+	with metrics.measure("save_fields") if metrics is not None else contextlib.nullcontext():
+		template = None
+		for point, save_path, field_key, time_limit in zip(points, save_paths, field_keys, time_limits):
+			data = cache.get(field_key) if cache is not None else None
+			
+			if data is None:
+				if template is None:
+					wrapper = TRIKMapWrapper(random_generator, options.deterministic_ids or cache is not None, \
+						options.width, options.height, generator.get_racks() if options.compact_constraints else ())
+					for wall in walls:
+						wrapper.add_wall(wall[0], wall[1])
+						
+					# Only the start point differs between the fields of the map
+					template = wrapper.compile_world()
+					
+				data = template.render((point[0], point[1]), point[2], time_limit)
+				if cache is not None:
+					cache.put(field_key, data)
+			elif metrics is not None:
+				metrics.counters["cache_hits"] += 1
+				
+			written_bytes = write_field(save_path, data)
+			if metrics is not None:
+				metrics.counters["written_bytes"] += written_bytes
+				
+	return len(points)
+	
+	
+def get_profile_path(options):
+	''' Returns the path of cProfile dump of the current process '''
+	
+	if options.jobs <= 1:
+		return options.cprofile
+		
+	# Dumps of the workers can be merged with pstats.Stats(*paths)
+	return "{0}.{1}".format(options.cprofile, os.getpid())
+	
+	
+# Profiler of the current process
+_profiler = None
+
+@contextlib.contextmanager
+def profile_process(options):
+	''' Collects cProfile stats of the block if --cprofile is set '''
+	
+	global _profiler
+	if options.cprofile is None:
+		yield
+		return
+		
+	if _profiler is None:
+		_profiler = cProfile.Profile()
+	_profiler.enable()
+	
+	try:
+		yield
+	finally:
+		_profiler.disable()
+		# Workers are stopped without notice, so the dump is updated after each map
+		_profiler.dump_stats(get_profile_path(options))
+		
+		
+def run_task(task):
+	''' Generates the map (unless the task carries it), returns the map index, 
+		the result of the generation and the metrics of the map (None unless --profile is set) '''
+		
+	map_index, map_seed, options, point_indices, generated_map = task
+	
+	if generated_map is not None:
+		metrics = generated_map[1]
+	else:
+		metrics = GeneratorMetrics() if options.profile is not None else None
+		
+	with profile_process(options):
+		if options.corpus is not None:
+			result = generate_map_record(task, metrics)
+		else:
+			result = generate_map_fields(task, metrics)
+			
+	if metrics is None:
+		return map_index, result, None
+		
+	return map_index, result, dict(map=map_index, seed=map_seed, **metrics.to_dict())
+	
+	
 class Program():
+	# Maps keyed at once per worker process
+	DEDUP_BATCH_SIZE = 64
+	
 	def _init_help(self):
 		parser = argparse.ArgumentParser(description="Generates TRIK Studio fields for the localization problem")
 		
 		parser.add_argument("path", nargs="?", default=".", metavar="PATH", help="save path")
 		parser.add_argument("--single", default=False, action="store_true", help="if set, generates only 1 field (30 by default)")
+		parser.add_argument("--width", type=int, default=MapGenerator.MAP_SIZE, metavar="W", help="map width in cells")
+		parser.add_argument("--height", type=int, default=MapGenerator.MAP_SIZE, metavar="H", help="map height in cells")
+		parser.add_argument("--count", type=int, default=1, metavar="N", help="number of maps to generate")
+		parser.add_argument("--jobs", type=int, default=1, metavar="J", help="number of worker processes")
+		parser.add_argument("--seed", type=int, default=None, metavar="S", 
+			help="seed of the batch, output does not depend on the number of jobs")
+		parser.add_argument("--deterministic-ids", default=False, action="store_true", 
+			help="if set, element ids are derived from the content")
+		parser.add_argument("--cache", default=None, metavar="CACHE_PATH", 
+			help="folder of the field cache (implies --deterministic-ids)")
+		parser.add_argument("--cache-size", type=int, default=1024, metavar="MB", help="field cache size limit")
+		parser.add_argument("--localizable-only", default=False, action="store_true", 
+			help="if set, start points which can not be localized are dropped")
+		parser.add_argument("--adaptive-time-limit", default=False, action="store_true", 
+			help="if set, time limit of every field is estimated from the moves needed to localize the robot")
+		parser.add_argument("--time-limit-slack", type=float, default=TRIKMapWrapper.TIME_LIMIT_SLACK, metavar="K", 
+			help="adaptive time limit is K times the estimated time of the moves")
+		parser.add_argument("--compact-constraints", default=False, action="store_true", 
+			help="if set, rack cells get no regions and events (the verdicts do not change)")
+		parser.add_argument("--dedup", default=False, action="store_true", 
+			help="if set, fields which repeat the earlier ones up to rotation or reflection are skipped")
+		parser.add_argument("--dedup-index", default=None, metavar="INDEX_PATH", 
+			help="file of the keys of the generated fields, keeps the batches distinct (implies --dedup)")
+		parser.add_argument("--corpus", default=None, metavar="CORPUS_PATH", 
+			help="if set, maps are stored to the corpus file instead of writing the fields")
+		parser.add_argument("--log-level", default="warning", choices=["debug", "info", "warning", "error"], 
+			help="level of the generator messages")
+		parser.add_argument("--profile", default=None, metavar="PROFILE_PATH", 
+			help="if set, phase times and counters of every map are written as JSON lines")
+		parser.add_argument("--cprofile", default=None, metavar="CPROFILE_PATH", 
+			help="if set, cProfile stats are dumped (one file per worker process)")
 		
 		return parser.parse_args(sys.argv[1:])
 		
 
 	def __init__(self):
 		self._parsed_arguments = self._init_help()
+		self._dedup_index = None
+		self._duplicate_field_number = 0
+		# Map index -> keys of the queued fields, stored to the index in the order 
+		# of the map indices when the map and all maps before it are done
+		self._queued_keys = collections.OrderedDict()
+		self._finished_maps = set()
 		
+		logging.basicConfig(level=self._parsed_arguments.log_level.upper(), format="%(levelname)s: %(message)s")
 		
-	def _is_multiple_start_point_requested(self):
-		return not self._parsed_arguments.single
 		
+	def _get_seed(self):
+		if self._parsed_arguments.seed is None:
+			self._parsed_arguments.seed = random.SystemRandom().getrandbits(64)
+			print("Seed: {0}".format(self._parsed_arguments.seed))
+			
+		return self._parsed_arguments.seed
 		
-	def _get_save_folder(self):
-		return self._parsed_arguments.path
 		
+	def _get_tasks(self):
+		seed = self._get_seed()
 		
-	def run(self):
-		generator = MapGenerator()
-		wrapper = TRIKMapWrapper()
+		for map_index in range(self._parsed_arguments.count):
+			yield (map_index, get_map_seed(seed, map_index), self._parsed_arguments, None, None)
+			
+			
+	def _get_unique_tasks(self, key_results):
+		''' Yields the tasks restricted to the start points which do not repeat the fields 
+			of the earlier maps, maps without such points are skipped. Results of 
+			get_point_keys() are checked in the order of the map indices '''
+			
+		for map_index, map_seed, point_keys, generated_map in key_results:
+			point_indices = [i for i, key in enumerate(point_keys) if self._dedup_index.add(key)]
+			self._duplicate_field_number += len(point_keys) - len(point_indices)
+			
+			if point_indices:
+				self._queued_keys[map_index] = [point_keys[i] for i in point_indices]
+				yield (map_index, map_seed, self._parsed_arguments, point_indices, generated_map)
+				
+				
+	def _get_results(self):
+		''' Yields the results of run_task(), corpus records are yielded in the order of the map indices '''
 		
-		for wall in generator.get_walls():
-			wrapper.add_wall(wall[0], wall[1])
+		arguments = self._parsed_arguments
+		if arguments.jobs <= 1:
+			tasks = self._get_tasks() if self._dedup_index is None else \
+				self._get_unique_tasks(map(get_point_keys, self._get_tasks()))
+			yield from map(run_task, tasks)
+		else:
+			with multiprocessing.Pool(arguments.jobs) as pool:
+				for tasks in self._get_task_batches(pool):
+					if arguments.corpus is not None:
+						yield from pool.imap(run_task, tasks, chunksize=16)
+					else:
+						yield from pool.imap_unordered(run_task, tasks)
+						
+						
+	def _get_task_batches(self, pool):
+		''' Yields the tasks for the pool. With dedup the maps are generated and keyed
+			in batches, so the generated maps waiting for run_task() take bounded memory '''
+			
+		if self._dedup_index is None:
+			yield self._get_tasks()
+			return
 			
-		if self._is_multiple_start_point_requested():
+		tasks = self._get_tasks()
+		batch_size = self.DEDUP_BATCH_SIZE * self._parsed_arguments.jobs
+		while True:
+			batch = list(itertools.islice(tasks, batch_size))
+			if not batch:
+				return
+				
+			yield list(self._get_unique_tasks(pool.imap(get_point_keys, batch, chunksize=16)))
+			
+			
+	def _record_keys(self, map_index):
+		''' Stores the keys of the finished maps once all maps before them are finished '''
+		
+		self._finished_maps.add(map_index)
+		while self._queued_keys and next(iter(self._queued_keys)) in self._finished_maps:
+			finished_map_index, keys = self._queued_keys.popitem(last=False)
+			self._finished_maps.remove(finished_map_index)
+			self._dedup_index.record(keys)
+					
+					
+	def run(self):
+		arguments = self._parsed_arguments
+		
+		with contextlib.ExitStack() as stack:
+			if arguments.dedup or arguments.dedup_index is not None:
+				self._dedup_index = stack.enter_context(DedupIndex(arguments.dedup_index))
+				
+			corpus = None
+			if arguments.corpus is not None:
+				corpus = stack.enter_context(MapCorpusWriter(arguments.corpus, arguments.width, arguments.height, \
+					adaptive_time_limit=arguments.adaptive_time_limit, time_limit_slack=arguments.time_limit_slack, \
+					compact_constraints=arguments.compact_constraints))
+				
+			profile_file = None
+			if arguments.profile is not None:
+				profile_file = stack.enter_context(open(arguments.profile, "w"))
+				
 			field_number = 0
-			for point in generator.get_new_start_point():
-				wrapper.set_start_point((point[0], point[1]), point[2])
-				wrapper.save_world("{0}/field_{1}.xml".format(self._get_save_folder(), field_number))
-				field_number += 1
+			map_number = 0
+			for map_index, result, metrics in self._get_results():
+				map_number += 1
+				if corpus is not None:
+					corpus.append_record(result)
+				else:
+					field_number += result
+					
+				# Keys of the maps which were not finished are not stored
+				if self._dedup_index is not None:
+					self._record_keys(map_index)
+					
+				if profile_file is not None:
+					profile_file.write(json.dumps(metrics) + "\n")
+					
+		if corpus is not None:
+			print("Stored {0} maps to {1}".format(map_number, arguments.corpus))
 		else:
-			point = next(generator.get_new_start_point())
-			wrapper.set_start_point((point[0], point[1]), point[2])
-			wrapper.save_world("{0}/field.xml".format(self._get_save_folder()))
+			print("Generated {0} fields".format(field_number))
 			
+		if self._dedup_index is not None:
+			print("Skipped {0} duplicate fields".format(self._duplicate_field_number))
 			
-generator = Program()
-generator.run()
-	
-	
-	
-	
-	
-	
-	
-	
-		
-		
\ No newline at end of file
+			
+if __name__ == "__main__":
+	generator = Program()
+	generator.run()
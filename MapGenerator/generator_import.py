@@ -1,29 +1,119 @@
 # -*- coding: utf-8 -*-
 import xml.etree.ElementTree as xml
 import uuid
+import hashlib
 import random
 import math
 import argparse
 import sys
 import collections
+import array
+import itertools
+import contextlib
+import logging
+import time
+import re
 from telnetlib import theNULL
 
+_logger = logging.getLogger(__name__)
+
+
+def get_map_seed(seed, map_index):
+	''' Derives the seed of the map with given index in the batch 
+		(does not depend on the process which generates the map) '''
+		
+	digest = hashlib.sha256("{0}:{1}".format(seed, map_index).encode("ascii")).digest()
+	
+	return int.from_bytes(digest[:8], "big")
+	
+
 class TRIKMapWrapper():
 	''' Instantiates the representation of the TRIK Studio 2D simulator world 
 	designed for solving localization problem '''
 
 	CELL_WIDTH = 200
 	CELL_HEIGHT = 200
-	MAP_SIZE = 8 # cells
+	MAP_SIZE = 8 # cells, default width and height
 	SOLVING_TIME_LIMIT = 360000 # ms
+	# Adaptive time limit: durations of the solution actions (script.js moves 
+	# the robot one cell in about 1.9 s and calibrates the gyroscope for 2.5 s)
+	CELL_MOVE_TIME = 2000 # ms
+	QUARTER_TURN_TIME = 1500 # ms
+	START_TIME = 5000 # ms
+	MIN_TIME_LIMIT = 60000 # ms
+	TIME_LIMIT_SLACK = 4.0
 	
 	LEFT_IR_SENSOR = "1" # Ax
 	RIGHT_IR_SENSOR = "2" # Ay
 	SONAR_SENSOR = "1" # Dx
+	# Sensor directions relative to the robot direction, degrees
+	LEFT_IR_SENSOR_DIRECTION = -90
+	RIGHT_IR_SENSOR_DIRECTION = 90
+	SONAR_SENSOR_DIRECTION = 0
+	SENSOR_DIRECTIONS = (LEFT_IR_SENSOR_DIRECTION, RIGHT_IR_SENSOR_DIRECTION, SONAR_SENSOR_DIRECTION)
 	LEFT_WHEEL_PORT_NUMBER = "1" # Mx
 	RIGHT_WHEEL_PORT_NUMBER = "2" # My
 	
+	START_POINT_PLACEHOLDER = "@{0}@"
 	
+	# Namespace of the deterministic element ids
+	ID_NAMESPACE = uuid.UUID("1bedb144-1b20-424a-a758-a0ca1e86759f")
+	# Must be changed with every change of the generated xml
+	FORMAT_VERSION = 1
+	
+	
+	def _get_new_id(self, content):
+		''' Generates new element id, in the deterministic mode
+			the id is derived from the element content '''
+		
+		if self._deterministic_ids:
+			return uuid.uuid5(self.ID_NAMESPACE, content)
+			
+		if self._random is None:
+			return uuid.uuid1()
+			
+		return uuid.UUID(int=self._random.getrandbits(128), version=4)
+		
+		
+	@classmethod
+	def get_time_limit(cls, exploration_moves, slack=TIME_LIMIT_SLACK):
+		''' Returns the time limit of the field in which the robot localizes itself
+			after exploration_moves=(forward moves, quarter turns), the limit is 
+			SOLVING_TIME_LIMIT if exploration_moves is None '''
+			
+		if exploration_moves is None:
+			return cls.SOLVING_TIME_LIMIT
+			
+		forward_moves, turns = exploration_moves
+		time_limit = cls.START_TIME + slack * (forward_moves * cls.CELL_MOVE_TIME + turns * cls.QUARTER_TURN_TIME)
+		
+		# Rounded up to seconds
+		time_limit = -(-int(math.ceil(time_limit)) // 1000) * 1000
+		return min(cls.SOLVING_TIME_LIMIT, max(cls.MIN_TIME_LIMIT, time_limit))
+		
+		
+	@classmethod
+	def get_constraint_parameters(cls, width, height, compact=False):
+		''' Returns parameters which affect the generated xml of 
+			the map with given size except walls and start point '''
+		
+		# Compact constraints depend only on the walls around the racks
+		return (("compact",) if compact else ()) + \
+			(
+				cls.FORMAT_VERSION,
+				cls.CELL_WIDTH,
+				cls.CELL_HEIGHT,
+				width,
+				height,
+				cls.SOLVING_TIME_LIMIT,
+				cls.LEFT_IR_SENSOR,
+				cls.RIGHT_IR_SENSOR,
+				cls.SONAR_SENSOR,
+				cls.LEFT_WHEEL_PORT_NUMBER,
+				cls.RIGHT_WHEEL_PORT_NUMBER
+			)
+			
+			
 	def _init_map_structure(self):
 		''' Initializes empty map file '''
 		
@@ -53,17 +143,17 @@ class TRIKMapWrapper():
 	
 		sensors = [	
 					( \
-						"-90",
+						str(self.LEFT_IR_SENSOR_DIRECTION),
 						"A{0}###input###A{0}###sensorA{0}".format(self.LEFT_IR_SENSOR),
 						"TrikInfraredSensor"
 					),
 					(
-						"90",
+						str(self.RIGHT_IR_SENSOR_DIRECTION),
 						"A{0}###input###A{0}###sensorA{0}".format(self.RIGHT_IR_SENSOR),
 						"TrikInfraredSensor"
 					),
 					(
-						"0",
+						str(self.SONAR_SENSOR_DIRECTION),
 						"D{0}###input######sensorD{0}".format(self.SONAR_SENSOR),
 						"TrikSonarSensor"
 					)]
@@ -102,7 +192,7 @@ class TRIKMapWrapper():
 							"direction": "0", 
 							"y": "{0}".format(self.CELL_HEIGHT // 2),
 							"x": "{0}".format(self.CELL_WIDTH // 2),
-							"id": "{{{0}}}".format(uuid.uuid1())
+							"id": "{{{0}}}".format(self._get_new_id("start:0:0:0"))
 						})
 						
 		sensors = xml.SubElement(robot, "sensors")
@@ -203,10 +293,11 @@ class TRIKMapWrapper():
 	def _add_solution_check_constraint(self, constraint_block):
 		''' Generates constraints for the constraints xml block '''
 		
-		for i in range(self.MAP_SIZE):
-			for j in range(self.MAP_SIZE):
-				self._add_cheating_constraint(constraint_block, j, i)
-				self._add_success_constraint(constraint_block, j, i)
+		for i in range(self._height):
+			for j in range(self._width):
+				if (j, i) not in self._excluded_cells:
+					self._add_cheating_constraint(constraint_block, j, i)
+					self._add_success_constraint(constraint_block, j, i)
 				
 				
 	def _init_constraints_block(self):
@@ -226,8 +317,11 @@ class TRIKMapWrapper():
 		
 		regions = self._map.find("world/regions")
 		
-		for i in range(8):
-			for j in range(8):
+		for i in range(self._height):
+			for j in range(self._width):
+				if (j, i) in self._excluded_cells:
+					continue
+					
 				xml.SubElement(regions, "region",
 					{ 
 						"type": "rectangle",
@@ -256,9 +350,19 @@ class TRIKMapWrapper():
 			})
 			
 		
-	def __init__(self): 
-		''' Initializes the new instance of TRIKMapWrapper '''
-		
+	def __init__(self, random_generator=None, deterministic_ids=False, width=MAP_SIZE, height=MAP_SIZE, \
+			excluded_cells=()): 
+		''' Initializes the new instance of TRIKMapWrapper for the grid of width x height cells,
+			element ids are taken from random_generator if it is set 
+			or derived from the content if deterministic_ids is set.
+			Cells (x, y) which the robot can not reach (racks) may be given 
+			in excluded_cells, they get no regions and events '''
+		
+		self._width = width
+		self._height = height
+		self._excluded_cells = set(excluded_cells)
+		self._random = random_generator
+		self._deterministic_ids = deterministic_ids
 		self._map = self._init_map_structure()
 		
 		self._init_world_block()
@@ -272,162 +376,830 @@ class TRIKMapWrapper():
 		''' Adds new wall with start_point=(x1, y1) and
 			end_point=(x2, y2) on the grid to the map '''
 			
+		begin = "{0}:{1}".format(start_point[0] * self.CELL_WIDTH, start_point[1] * self.CELL_HEIGHT)
+		end = "{0}:{1}".format(end_point[0] * self.CELL_WIDTH, end_point[1] * self.CELL_HEIGHT)
+		ends = sorted((tuple(start_point), tuple(end_point)))
+			
 		walls_block = self._map.find("world/walls")
 		xml.SubElement(walls_block, "wall",
 			{
-				"begin": "{0}:{1}".format(start_point[0] * self.CELL_HEIGHT, start_point[1] * self.CELL_WIDTH),
-				"end": "{0}:{1}".format(end_point[0] * self.CELL_HEIGHT, end_point[1] * self.CELL_WIDTH),
-				"id": "{{{0}}}".format(str(uuid.uuid1()))
+				"begin": begin,
+				"end": end,
+				"id": "{{{0}}}".format(self._get_new_id("wall:{0}:{1}:{2}:{3}".format( \
+					ends[0][0], ends[0][1], ends[1][0], ends[1][1])))
 			})
 			
 		
-	def set_start_point(self, point, direction):
-		''' Sets new start point for the robot
-			with given grid coordinate point=(x, y) and given direction '''
-	
+	def _get_start_point_attributes(self, point, direction, time_limit=None):
+		''' Returns values of the attributes which depend on the start point,
+			SOLVING_TIME_LIMIT is used unless time_limit is given '''
+		
 		coordinate_x = self.CELL_WIDTH * point[0]
 		coordinate_y = self.CELL_HEIGHT * point[1]
-	
-		start_point = self._map.find("world/regions/region[@id='start']")
-		start_point.set("x", str(coordinate_x))
-		start_point.set("y", str(coordinate_y))
 		
-		robot = self._map.find("robots/robot")
-		robot.set("direction", str(direction))
-		# 25 is some kind of magic used in original maps from TRIK devs
-		robot.set("position", "{0}:{1}".format( \
-			coordinate_x + self.CELL_WIDTH // 2 - 25, coordinate_y + self.CELL_HEIGHT // 2 - 25))
+		attributes = \
+			{
+				"region_x": str(coordinate_x),
+				"region_y": str(coordinate_y),
+				"robot_direction": str(direction),
+				# 25 is some kind of magic used in original maps from TRIK devs
+				"robot_position": "{0}:{1}".format( \
+					coordinate_x + self.CELL_WIDTH // 2 - 25, coordinate_y + self.CELL_HEIGHT // 2 - 25),
+				"start_direction": str(direction),
+				"start_x": str(coordinate_x + self.CELL_WIDTH // 2),
+				"start_y": str(coordinate_y + self.CELL_HEIGHT // 2),
+				"time_limit": str(time_limit if time_limit is not None else self.SOLVING_TIME_LIMIT)
+			}
+			
+		if self._deterministic_ids:
+			attributes["start_id"] = "{{{0}}}".format(self._get_new_id( \
+				"start:{0}:{1}:{2}".format(point[0], point[1], direction)))
+				
+		return attributes
 		
-		start_position = robot.find("startPosition")
-		start_position.set("direction", str(direction))
-		start_position.set("x", str(coordinate_x + self.CELL_WIDTH // 2))
-		start_position.set("y", str(coordinate_y + self.CELL_HEIGHT // 2))
 		
+	def _get_start_point_elements(self):
+		''' Returns (attribute key, element, attribute name) 
+			for each attribute which depends on the start point '''
+		
+		start_point = self._map.find("world/regions/region[@id='start']")
+		robot = self._map.find("robots/robot")
+		start_position = robot.find("startPosition")
+		time_limit = self._map.find("constraints/timelimit")
 		
+		return \
+			(
+				("region_x", start_point, "x"),
+				("region_y", start_point, "y"),
+				("robot_direction", robot, "direction"),
+				("robot_position", robot, "position"),
+				("start_direction", start_position, "direction"),
+				("start_x", start_position, "x"),
+				("start_y", start_position, "y"),
+				("time_limit", time_limit, "value")
+			) + ((("start_id", start_position, "id"),) if self._deterministic_ids else ())
+			
+			
+	def set_start_point(self, point, direction, time_limit=None):
+		''' Sets new start point for the robot
+			with given grid coordinate point=(x, y) and given direction '''
+	
+		attributes = self._get_start_point_attributes(point, direction, time_limit)
+		for key, element, attribute in self._get_start_point_elements():
+			element.set(attribute, attributes[key])
+			
+			
 	def save_world(self, savePath):
 		''' Writes map to the file '''
 		
 		xml.ElementTree(self._map).write(savePath, encoding="utf8", xml_declaration=False)
 		
 		
-class ConnectivityComponent():
-	''' Represents connectivity component in the graph '''
+	def compile_world(self):
+		''' Serializes the map once with placeholders instead of 
+			the start point attributes, returns WorldTemplate '''
+			
+		elements = self._get_start_point_elements()
+		old_values = [element.get(attribute) for key, element, attribute in elements]
+		
+		for key, element, attribute in elements:
+			element.set(attribute, self.START_POINT_PLACEHOLDER.format(key))
+			
+		data = xml.tostring(self._map, encoding="utf8", xml_declaration=False)
+		
+		for (key, element, attribute), value in zip(elements, old_values):
+			element.set(attribute, value)
+			
+		return WorldTemplate(data, self._get_start_point_attributes, self.START_POINT_PLACEHOLDER)
+		
+		
+class WorldTemplate():
+	''' Serialized map of TRIKMapWrapper in which only 
+		the start point attributes are left to fill '''
+		
+	def __init__(self, data, get_attributes, placeholder):
+		self._get_attributes = get_attributes
+		
+		# Odd parts are attribute keys, even parts are constant chunks
+		pattern = re.escape(placeholder.encode("utf8")).replace(b"\\{0\\}", b"(\\w+)")
+		self._parts = re.split(pattern, data)
+		for i in range(1, len(self._parts), 2):
+			self._parts[i] = self._parts[i].decode("utf8")
+			
+			
+	def render(self, point, direction, time_limit=None):
+		''' Returns the map with given start point as bytes '''
+		
+		attributes = self._get_attributes(point, direction, time_limit)
+		parts = list(self._parts)
+		for i in range(1, len(parts), 2):
+			parts[i] = attributes[parts[i]].encode("utf8")
+			
+		return b"".join(parts)
+		
+		
+	def save_world(self, savePath, point, direction, time_limit=None):
+		''' Writes the map with given start point to the file,
+			returns the number of written bytes '''
+			
+		data = self.render(point, direction, time_limit)
+		with open(savePath, "wb") as world_file:
+			world_file.write(data)
+			
+		return len(data)
+		
+		
+class DisjointSet():
+	''' Represents connectivity components of the racks as a disjoint-set forest
+		(union by rank, path compression) '''
 	
-	def __init__(self, id):
-		self._component_connection_prohibited = False
-		self._id = id
+	def __init__(self, size):
+		self._parent = list(range(size))
+		self._rank = [0] * size
+		self._component_connection_prohibited = [False] * size
+		
+		# Live roots are stored with their positions in order
+		# to remove and sample them in O(1)
+		self._roots = list(range(size))
+		self._root_positions = list(range(size))
+		
+		
+	def _remove_root(self, root):
+		position = self._root_positions[root]
+		last_root = self._roots.pop()
+		if last_root != root:
+			self._roots[position] = last_root
+			self._root_positions[last_root] = position
+			
+			
+	def make_set(self):
+		''' Adds new single-element component and returns its id '''
 		
-
-	def get_component_id(self):
-		return self._id
+		new_id = len(self._parent)
+		self._parent.append(new_id)
+		self._rank.append(0)
+		self._component_connection_prohibited.append(False)
+		
+		self._root_positions.append(len(self._roots))
+		self._roots.append(new_id)
+		
+		return new_id
+		
+		
+	def find(self, item):
+		''' Returns the id of the component which contains the item '''
+		
+		root = item
+		while self._parent[root] != root:
+			root = self._parent[root]
+			
+		while self._parent[item] != root:
+			self._parent[item], item = root, self._parent[item]
+			
+		return root
+		
+		
+	def union(self, first_item, second_item):
+		''' Merges components of 2 items, returns False 
+			if they are already in the same component '''
 		
+		first_root = self.find(first_item)
+		second_root = self.find(second_item)
+		if first_root == second_root:
+			return False
+			
+		if self._rank[first_root] < self._rank[second_root]:
+			first_root, second_root = second_root, first_root
+		elif self._rank[first_root] == self._rank[second_root]:
+			self._rank[first_root] += 1
+			
+		self._parent[second_root] = first_root
+		if self._component_connection_prohibited[second_root]:
+			self._component_connection_prohibited[first_root] = True
+		self._remove_root(second_root)
+		
+		return True
 		
-	def set_component_id(self, new_id):
-		self._id = new_id
 		
+	def get_component_number(self):
+		return len(self._roots)
 		
-	def __hash__(self):
-		return self._id
 		
+	def get_prohibited_component_number(self):
+		return sum(1 for root in self._roots if self._component_connection_prohibited[root])
 		
-	def __eq__(self, other):
-		return self._id == other._id
 		
+	def choose_mergeable_pair(self, random_generator):
+		''' Returns 2 different random components '''
 		
-	def is_intercomponent_prohibited(self):
-		return self._component_connection_prohibited
+		return random_generator.sample(self._roots, 2)
 		
 		
-	def prohibit_connection_with_other_components(self):
-		self._component_connection_prohibited = True
+	def is_intercomponent_prohibited(self, item):
+		return self._component_connection_prohibited[self.find(item)]
+		
+		
+	def prohibit_connection_with_other_components(self, item):
+		self._component_connection_prohibited[self.find(item)] = True
 		
 		
 class MapRepresentation():
-	''' Represents map used by the map generator '''
+	''' Represents map used by the map generator.
+	
+		The grid has width x height cells, node (i, j) is the corner with
+		coordinates x = i, y = j. Component ids of the grid nodes are stored 
+		in a flat array. Walls are stored in 2 bit-packed arrays: segments 
+		(i, j)-(i + 1, j) and segments (i, j)-(i, j + 1). Both nodes and walls 
+		are addressed by integer ids '''
 	
 	EMPTY_CELL_COMPONENT_ID = -1
 	
-	def __init__(self, size):
-		self.grid = []
-		self.components = [ ConnectivityComponent(self.EMPTY_CELL_COMPONENT_ID) ]
-		self.walls = set()
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.components = DisjointSet(0)
+		
+		self._row_length = height + 1
+		self._nodes = array.array("i", [self.EMPTY_CELL_COMPONENT_ID]) * ((width + 1) * self._row_length)
+		
+		# Segment (i, j)-(i + 1, j) has the same id as node (i, j),
+		# segment (i, j)-(i, j + 1) has id first_axis_wall_number + i * height + j
+		self._first_axis_wall_number = width * self._row_length
+		self._second_axis_wall_number = (width + 1) * height
+		self._first_axis_walls = bytearray((self._first_axis_wall_number + 7) // 8)
+		self._second_axis_walls = bytearray((self._second_axis_wall_number + 7) // 8)
+		
+		
+	def get_node_id(self, i, j):
+		return i * self._row_length + j
+		
+		
+	def get_node(self, node_id):
+		return divmod(node_id, self._row_length)
+		
+		
+	def get_component(self, node_id):
+		return self._nodes[node_id]
+		
+		
+	def set_component(self, node_id, component_id):
+		self._nodes[node_id] = component_id
+		
+		
+	def get_adjacent_node_ids(self, node_id):
+		''' Returns ids of the nodes adjacent to the given one '''
+		
+		i, j = divmod(node_id, self._row_length)
+		adjacent_node_ids = []
+		if i < self.width:
+			adjacent_node_ids.append(node_id + self._row_length)
+		if i > 0:
+			adjacent_node_ids.append(node_id - self._row_length)
+		if j < self.height:
+			adjacent_node_ids.append(node_id + 1)
+		if j > 0:
+			adjacent_node_ids.append(node_id - 1)
+			
+		return adjacent_node_ids
+		
+		
+	def get_edge_id(self, first_node_id, second_node_id):
+		''' Returns the id of the segment between 2 adjacent nodes '''
+		
+		if first_node_id > second_node_id:
+			first_node_id, second_node_id = second_node_id, first_node_id
+			
+		if second_node_id - first_node_id == 1:
+			return self._first_axis_wall_number + first_node_id - first_node_id // self._row_length
+			
+		return first_node_id
+		
+		
+	def get_edge_node_ids(self, edge_id):
+		''' Returns ids of the nodes connected by the segment '''
+		
+		if edge_id < self._first_axis_wall_number:
+			return (edge_id, edge_id + self._row_length)
+			
+		i, j = divmod(edge_id - self._first_axis_wall_number, self.height)
+		node_id = i * self._row_length + j
+		
+		return (node_id, node_id + 1)
+		
+		
+	def get_wall_nodes(self, edge_id):
+		''' Returns ((i1, j1), (i2, j2)) coordinates of the segment ends '''
+		
+		first_node_id, second_node_id = self.get_edge_node_ids(edge_id)
+		
+		return (self.get_node(first_node_id), self.get_node(second_node_id))
+		
+		
+	def has_wall(self, edge_id):
+		if edge_id < self._first_axis_wall_number:
+			return self._first_axis_walls[edge_id >> 3] >> (edge_id & 7) & 1 == 1
+			
+		edge_id -= self._first_axis_wall_number
+		return self._second_axis_walls[edge_id >> 3] >> (edge_id & 7) & 1 == 1
+		
+		
+	def add_wall(self, edge_id):
+		if edge_id < self._first_axis_wall_number:
+			self._first_axis_walls[edge_id >> 3] |= 1 << (edge_id & 7)
+		else:
+			edge_id -= self._first_axis_wall_number
+			self._second_axis_walls[edge_id >> 3] |= 1 << (edge_id & 7)
+			
+			
+	def remove_wall(self, edge_id):
+		if edge_id < self._first_axis_wall_number:
+			self._first_axis_walls[edge_id >> 3] &= ~(1 << (edge_id & 7))
+		else:
+			edge_id -= self._first_axis_wall_number
+			self._second_axis_walls[edge_id >> 3] &= ~(1 << (edge_id & 7))
+			
+			
+	def get_wall_data(self):
+		''' Returns both bit-packed wall arrays as bytes '''
+		
+		return bytes(self._first_axis_walls) + bytes(self._second_axis_walls)
+		
+		
+	def set_wall_data(self, data):
+		''' Replaces all walls by the data returned by get_wall_data() '''
+		
+		first_axis_size = len(self._first_axis_walls)
+		self._first_axis_walls[:] = data[:first_axis_size]
+		self._second_axis_walls[:] = data[first_axis_size:first_axis_size + len(self._second_axis_walls)]
+		
+		
+	def iter_wall_ids(self):
+		''' Yields ids of all walls in increasing order '''
+		
+		for offset, walls in ((0, self._first_axis_walls), 
+				(self._first_axis_wall_number, self._second_axis_walls)):
+			for byte_index in range(len(walls)):
+				byte = walls[byte_index]
+				while byte:
+					bit = byte & -byte
+					yield offset + (byte_index << 3) + bit.bit_length() - 1
+					byte ^= bit
+					
+					
+	@property
+	def grid(self):
+		''' Nested lists view of the node component ids '''
+		
+		return [self._nodes[i * self._row_length:(i + 1) * self._row_length].tolist() \
+			for i in range(self.width + 1)]
+			
+			
+	@property
+	def walls(self):
+		''' Set view of the walls as pairs of segment ends '''
+		
+		return set(self.get_wall_nodes(edge_id) for edge_id in self.iter_wall_ids())
+		
+		
+class WallConnectivity():
+	''' Tracks grid nodes connected by walls.
+	
+		The graph of free cells and the graph of walls are planar duals,
+		so a new wall separates 2 connected cells if and only if its ends
+		are already connected by walls. This answers closed structure 
+		queries in amortized constant time instead of a flood fill per wall '''
+	
+	def __init__(self, board, prohibited_cells):
+		self._nodes = DisjointSet((board.width + 1) * (board.height + 1))
+		
+		for edge_id in board.iter_wall_ids():
+			self.add_wall(*board.get_edge_node_ids(edge_id))
+			
+		start_point = (0, 0) # Cell coordinates
+		for i in range(board.width):
+			for j in range(board.height):
+				if not (i, j) in prohibited_cells:
+					start_point = (i, j)
+					
+		expected_free_points = board.width * board.height - len(prohibited_cells)
+		self._are_free_cells_connected = \
+			self._count_free_points(board, start_point) == expected_free_points
+			
+			
+	def _count_free_points(self, board, start_point):
+		''' Counts the number of points which are reachable from given start point '''
+		
+		height = board.height
+		used = bytearray(board.width * height)
+		
+		start_cell = start_point[0] * height + start_point[1]
+		used[start_cell] = 1
+		result = 0
+		
+		stack = [start_cell]
+		while stack:
+			cell = stack.pop()
+			result += 1
+			
+			# Cell (i, j) is bounded by nodes (i, j) and (i + 1, j + 1)
+			node_id = board.get_node_id(*divmod(cell, height))
+			neighbours = \
+				(
+					(cell + 1, board.get_edge_id(node_id + 1, node_id + height + 2)),
+					(cell + height, board.get_edge_id(node_id + height + 1, node_id + height + 2)),
+					(cell - height, board.get_edge_id(node_id, node_id + 1)),
+					(cell - 1, board.get_edge_id(node_id, node_id + height + 1))
+				)
+				
+			for neighbour, edge_id in neighbours:
+				if not board.has_wall(edge_id) and not used[neighbour]:
+					used[neighbour] = 1
+					stack.append(neighbour)
+					
+		return result
+		
+		
+	def add_wall(self, first_node_id, second_node_id):
+		''' Registers the wall placed on the board '''
+		
+		self._nodes.union(first_node_id, second_node_id)
+		
+		
+	def is_closing(self, board, first_node_id, second_node_id):
+		''' Checks if there would be closed wall structures 
+			on the board after adding new wall '''
+			
+		if not self._are_free_cells_connected:
+			return True
+			
+		if board.has_wall(board.get_edge_id(first_node_id, second_node_id)):
+			return False
+			
+		return self._nodes.find(first_node_id) == self._nodes.find(second_node_id)
+		
+		
+class WallCandidateFrontier():
+	''' Keeps all wall candidates: pairs of a component node and an adjacent
+		available node. Sampling is the same as choosing a component uniformly,
+		then its node uniformly, then an adjacent node uniformly and retrying
+		until the adjacent node is available, but without the retries '''
+		
+	def __init__(self, board, components, available_node_ids):
+		''' Initializes the frontier of component nodes given as
+			component id -> list of node ids '''
+			
+		self._board = board
+		self._available_node_ids = set(available_node_ids)
+		
+		# Candidates of each component are kept in a list, candidate ->
+		# (component id, position in the list) allows to remove them in O(1)
+		self._component_sizes = {}
+		self._candidates = {}
+		self._candidate_positions = {}
+		
+		# Component weights in the order of components and a Fenwick tree 
+		# of their prefix sums, so a component is chosen in O(log components)
+		self._component_indices = {}
+		self._component_order = []
+		self._weights = [0.0] * len(components)
+		self._weight_tree = [0.0] * (len(components) + 1)
+		
+		for component_id, node_ids in components.items():
+			self._component_indices[component_id] = len(self._component_indices)
+			self._component_order.append(component_id)
+			self._component_sizes[component_id] = 0
+			self._candidates[component_id] = []
+			for node_id in node_ids:
+				self.add_node(component_id, node_id)
+				
+				
+	def _add_candidate(self, component_id, candidate):
+		self._candidate_positions[candidate] = (component_id, len(self._candidates[component_id]))
+		self._candidates[component_id].append(candidate)
+		
+		
+	def _remove_candidate(self, candidate):
+		component_id, position = self._candidate_positions.pop(candidate)
+		candidates = self._candidates[component_id]
+		
+		last_candidate = candidates.pop()
+		if last_candidate != candidate:
+			candidates[position] = last_candidate
+			self._candidate_positions[last_candidate] = (component_id, position)
+			
+		return component_id
+		
+		
+	def _update_weight(self, component_id):
+		''' Sets the component weight to the share of its nodes having candidates '''
+		
+		index = self._component_indices[component_id]
+		weight = len(self._candidates[component_id]) / float(self._component_sizes[component_id])
+		change = weight - self._weights[index]
+		self._weights[index] = weight
+		
+		index += 1
+		while index < len(self._weight_tree):
+			self._weight_tree[index] += change
+			index += index & -index
+			
+			
+	def _get_weight_sum(self):
+		index = len(self._weights)
+		weight_sum = 0.0
+		while index > 0:
+			weight_sum += self._weight_tree[index]
+			index -= index & -index
+			
+		return weight_sum
+		
+		
+	def _find_component_index(self, choice):
+		''' Returns the index of the first component whose prefix sum of weights exceeds choice '''
 		
-		for i in range(size + 1):
-			self.grid.append([self.EMPTY_CELL_COMPONENT_ID for j in range(size + 1)])		
+		index = 0
+		step = 1 << (len(self._weights).bit_length() - 1) if self._weights else 0
+		while step > 0:
+			if index + step <= len(self._weights) and self._weight_tree[index + step] <= choice:
+				index += step
+				choice -= self._weight_tree[index]
+			step //= 2
 			
+		return index
+		
+		
+	def add_node(self, component_id, node_id):
+		''' Adds the node to the component with all its candidates '''
+		
+		self._component_sizes[component_id] += 1
+		for adjacent_node_id in self._board.get_adjacent_node_ids(node_id):
+			if adjacent_node_id in self._available_node_ids:
+				self._add_candidate(component_id, (node_id, adjacent_node_id))
+				
+		self._update_weight(component_id)
+		
+				
+	def remove_target(self, node_id):
+		''' Makes the node unavailable removing all candidates leading to it '''
+		
+		self._available_node_ids.discard(node_id)
+		for adjacent_node_id in self._board.get_adjacent_node_ids(node_id):
+			candidate = (adjacent_node_id, node_id)
+			if candidate in self._candidate_positions:
+				self._update_weight(self._remove_candidate(candidate))
+					
+					
+	def is_empty(self):
+		return len(self._candidate_positions) == 0
+		
+		
+	def choose(self, random_generator):
+		''' Returns random (component node, available node) pair,
+			component is chosen with weight proportional to the share 
+			of its nodes having candidates '''
+			
+		choice = random_generator.random() * self._get_weight_sum()
+		index = self._find_component_index(choice)
+		
+		if index == len(self._weights) or self._weights[index] == 0:
+			# Rounding errors of the tree sums may point at a component without 
+			# candidates, then the exact weights are scanned as a whole
+			for index, weight in enumerate(self._weights):
+				choice -= weight
+				if weight > 0:
+					last_index = index
+				if choice < 0:
+					break
+			index = last_index
+			
+		candidates = self._candidates[self._component_order[index]]
+		return candidates[random_generator.randrange(len(candidates))]
+		
+		
+class SensorSignatureIndex():
+	''' Groups the start poses (x, y, direction) by the sensor signature: walls 
+		which the robot sensors see next to the start cell. Bit k of the signature
+		is set if there is a wall in the direction of the sensor 
+		TRIKMapWrapper.SENSOR_DIRECTIONS[k]. Poses with the same signature can not
+		be told apart without moving '''
+		
+	DIRECTIONS = (0, 90, -90, 180)
+	
+	def __init__(self, board, restricted_cells):
+		''' Builds the index for all cells of the board except restricted ones '''
+		
+		self._signatures = {}
+		self._poses_by_signature = collections.defaultdict(list)
+		
+		for x in range(board.width):
+			for y in range(board.height):
+				if (x, y) in restricted_cells:
+					continue
+					
+				for direction in self.DIRECTIONS:
+					pose = (x, y, direction)
+					signature = self.get_pose_signature(board, pose)
+					
+					self._signatures[pose] = signature
+					self._poses_by_signature[signature].append(pose)
+					
+					
+	@classmethod
+	def get_pose_signature(cls, board, pose):
+		''' Returns the signature of the pose (x, y, direction) on the board '''
+		
+		x, y, direction = pose
+		signature = 0
+		for k, sensor_direction in enumerate(TRIKMapWrapper.SENSOR_DIRECTIONS):
+			if cls.has_wall(board, x, y, direction + sensor_direction):
+				signature |= 1 << k
 				
+		return signature
+		
+		
+	@staticmethod
+	def has_wall(board, x, y, direction):
+		''' Checks if there is a wall next to the cell in the direction,
+			0 is along x axis and 90 is along y axis '''
+			
+		direction %= 360
+		if direction == 0:
+			first_node, second_node = (x + 1, y), (x + 1, y + 1)
+		elif direction == 90:
+			first_node, second_node = (x, y + 1), (x + 1, y + 1)
+		elif direction == 180:
+			first_node, second_node = (x, y), (x, y + 1)
+		else:
+			first_node, second_node = (x, y), (x + 1, y)
+			
+		return board.has_wall(board.get_edge_id( \
+			board.get_node_id(*first_node), board.get_node_id(*second_node)))
+			
+			
+	def get_poses(self):
+		return list(self._signatures)
+		
+		
+	def get_signature(self, pose):
+		return self._signatures[pose]
+		
+		
+	def get_signature_poses(self, signature):
+		''' Returns all poses with the signature '''
+		
+		return self._poses_by_signature.get(signature, [])
+		
+		
+	def get_ambiguity(self, pose):
+		''' Returns the number of poses which look the same as the given one '''
+		
+		return len(self._poses_by_signature[self._signatures[pose]])
+		
+		
+class GeneratorMetrics():
+	''' Time spent in the generation phases and the hot loop counters of one map '''
+	
+	# Counters of MapGenerator, reported even if they are zero
+	COUNTERS = ("component_merges", "built_walls")
+	
+	def __init__(self):
+		self.phase_times = collections.defaultdict(float)
+		self.counters = collections.Counter(dict.fromkeys(self.COUNTERS, 0))
+		
+		
+	@contextlib.contextmanager
+	def measure(self, phase):
+		''' Adds the time spent in the block to the phase '''
+		
+		start_time = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.phase_times[phase] += time.perf_counter() - start_time
+			
+			
+	def to_dict(self):
+		return { "phase_times": dict(self.phase_times), "counters": dict(self.counters) }
+		
+		
 class MapGenerator():
 	''' Instantiates the generator of the map for the localization problem '''
 
+	# Rack and wall numbers are given for the MAP_SIZE x MAP_SIZE grid
+	# and are scaled to the area of the generated map
 	MIN_RACK_NUMBER = 7
 	MAX_RACK_NUMBER = 10
 
 	MIN_WALLS_NUMBER = 45
 	MAX_WALLS_NUMBER = 60
 	
-	MAP_SIZE = 8 # cells
+	MAP_SIZE = 8 # cells, default width and height
 	START_POINT_NUMBER = 30 # points
+	# 0 gives uniform start points, greater values prefer ambiguous ones
+	START_POINT_AMBIGUITY_BIAS = 1.0
 	
 	CYCLIC_STRUCTURE_PROBABILITY = 0.3
 	
+	# Cells around the rack in circular order starting from the top one
+	RACK_RING_SHIFTS = ((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1))
+	
 	
-	def _merge_components(self, board, destination_component_id, source_component_id):
-		''' Merges 2 connectivity components '''
-		
-		for component in board.components:
-			if component.get_component_id() == source_component_id:
-				component.set_component_id(destination_component_id)
-					
-		return board
-		
-		
 	def _merge_adjacent_components(self, board, racks):
 		''' Uniting components which contains adjacent cells '''
 		
-		rack_set = set(racks)	
+		rack_indices = { rack: i for i, rack in enumerate(racks) }
+		shifts = ((-1, 0), (0, -1), (-1, -1))
 		for i in range(len(racks)):
 			rack = racks[i]
-			component = board.components[i].get_component_id()
 			
-			shifts = ((-1, 0), (0, -1), (-1, -1))
 			for shift in shifts:
 				adjacent_cell = (rack[0] + shift[0], rack[1] + shift[1])
-				if adjacent_cell in rack_set:
-					adj_cell_component = \
-						board.components[racks.index(adjacent_cell)].get_component_id()
-					self._merge_components(board, component, adj_cell_component)
+				if adjacent_cell in rack_indices:
+					board.components.union(i, rack_indices[adjacent_cell])
 		
 		return board
 		
 		
-	def _reduce_actual_components_number(self, board, racks, target_component_number):
+	def _reduce_actual_components_number(self, board, target_component_number):
 		''' Reducing actual component number in order to 
 			make it equal to chosen component_number '''
 			
-		actual_component_number = len(racks)
-		while actual_component_number > target_component_number:
-			first_component_to_unite = random.randint(0, len(racks) - 1)
-			second_component_to_unite = random.randint(0, len(racks) - 1)
-			
-			old_component = board.components[first_component_to_unite].get_component_id()
-			new_component = board.components[second_component_to_unite].get_component_id()	
-			if old_component != new_component:
-				actual_component_number -= 1
-				self._merge_components(board, old_component, new_component)
+		while board.components.get_component_number() > target_component_number:
+			first_component, second_component = board.components.choose_mergeable_pair(self._random)
+			board.components.union(first_component, second_component)
+			self._count("component_merges")
 				
 		return board
 		
 		
+	def _are_cells_connected(self, is_blocked, start, finish):
+		''' Checks if there is a path between the free cells. Searches grow from both
+			cells, the one with the smaller frontier first, so the check costs the path 
+			or the smaller cut off part rather than the whole map '''
+			
+		used = [{ start }, { finish }]
+		frontiers = [[start], [finish]]
+		while frontiers[0] and frontiers[1]:
+			side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+			next_frontier = []
+			for x, y in frontiers[side]:
+				for cell in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+					if cell in used[1 - side]:
+						return True
+					if not cell in used[side] and not is_blocked(cell):
+						used[side].add(cell)
+						next_frontier.append(cell)
+						
+			frontiers[side] = next_frontier
+			
+		return False
+		
+		
+	def _are_free_cells_connected(self, racks, new_rack):
+		''' Checks if the cells without racks stay connected after placing the new rack '''
+		
+		is_blocked = lambda cell: cell == new_rack or cell in racks or \
+			not (0 <= cell[0] < self._width and 0 <= cell[1] < self._height)
+			
+		# Free neighbours of the rack connected around it through the surrounding 
+		# 8 cells stay connected, so only the other case needs a search
+		ring = [not is_blocked((new_rack[0] + dx, new_rack[1] + dy)) for dx, dy in self.RACK_RING_SHIFTS]
+		if all(ring):
+			return True
+			
+		# Every free cell was connected to the rack cell through one of its neighbours,
+		# so it is enough to connect a neighbour of each arc with the others
+		first_blocked = ring.index(False)
+		arc_neighbours = []
+		arc_neighbour = None
+		for k in range(first_blocked + 1, first_blocked + len(ring) + 1):
+			k %= len(ring)
+			if ring[k]:
+				# Even positions of the ring are adjacent to the rack by side
+				if arc_neighbour is None and k % 2 == 0:
+					dx, dy = self.RACK_RING_SHIFTS[k]
+					arc_neighbour = (new_rack[0] + dx, new_rack[1] + dy)
+			elif arc_neighbour is not None:
+				arc_neighbours.append(arc_neighbour)
+				arc_neighbour = None
+				
+		return all(self._are_cells_connected(is_blocked, arc_neighbours[0], neighbour) \
+			for neighbour in arc_neighbours[1:])
+		
+		
 	def _generate_racks_position(self, board, rack_number):
 		''' Selects rack positions on the  '''
 	
-		print("Generating {0} racks...".format(rack_number))
+		_logger.debug("Generating %d racks...", rack_number)
 		
 		rack_set = set()
 		# Choosing left-top corner position of the rack
 		while (len(rack_set) < rack_number):
-			new_rack = (random.randint(0, self.MAP_SIZE - 1), random.randint(0, self.MAP_SIZE - 1))
-			rack_set.add(new_rack)
+			new_rack = (self._random.randint(0, self._width - 1), self._random.randint(0, self._height - 1))
+			
+			# Racks must not cut off free cells
+			if not new_rack in rack_set and self._are_free_cells_connected(rack_set, new_rack):
+				rack_set.add(new_rack)
 
 		racks = list(rack_set)
 		
@@ -439,11 +1211,9 @@ class MapGenerator():
 	def _init_components(self, board, component_number):
 		''' Initializes connectivity components '''
 		
-		print("Generating {0} connectivity components...".format(component_number))
+		_logger.debug("Generating %d connectivity components...", component_number)
 		
-		board.components = [ConnectivityComponent(i) for i in range(0, component_number)]
-		# Component for the border
-		board.components.append(ConnectivityComponent(component_number))
+		board.components = DisjointSet(component_number)
 		
 		return board
 		
@@ -452,35 +1222,36 @@ class MapGenerator():
 		''' Prohibiting connection with other components for some 
 			connectivity components in order to create cyclic structures '''
 
-		cyclic_structures_number = 0
-		# Only components with id == index are independent 
-		# due to generation algorithm 
-		# "-1" is to prevent triggering for the border
-		for i in range(len(board.components) - 1):
-			if board.components[i].get_component_id() == i and \
-					random.random() < self.CYCLIC_STRUCTURE_PROBABILITY:
+		for i in range(len(racks)):
+			if board.components.find(i) == i and \
+					self._random.random() < self.CYCLIC_STRUCTURE_PROBABILITY:
 					
-				board.components[i].prohibit_connection_with_other_components()
-				cyclic_structures_number += 1
+				board.components.prohibit_connection_with_other_components(i)
 				
-		print("Generated {0} cyclic structures".format(cyclic_structures_number))
+		_logger.debug("Generated %d cyclic structures", board.components.get_prohibited_component_number())
 		
 				
 	def _generate_border(self, board, border_id):
 		''' Generates border walls '''
 	
 		# Placing border
-		for i in range(self.MAP_SIZE + 1):
-			board.grid[0][i] = border_id
-			board.grid[i][0] = border_id
-			board.grid[self.MAP_SIZE][i] = border_id
-			board.grid[i][self.MAP_SIZE] = border_id
-			
-		for i in range(self.MAP_SIZE):
-			board.walls.add(((0, i), (0, i + 1)))
-			board.walls.add(((i, 0), (i + 1, 0)))
-			board.walls.add(((i, self.MAP_SIZE), (i + 1, self.MAP_SIZE)))
-			board.walls.add(((self.MAP_SIZE, i), (self.MAP_SIZE, i + 1)))
+		for i in range(self._width + 1):
+			board.set_component(board.get_node_id(i, 0), border_id)
+			board.set_component(board.get_node_id(i, self._height), border_id)
+			
+		for j in range(self._height + 1):
+			board.set_component(board.get_node_id(0, j), border_id)
+			board.set_component(board.get_node_id(self._width, j), border_id)
+			
+		for i in range(self._width):
+			board.add_wall(board.get_edge_id(board.get_node_id(i, 0), board.get_node_id(i + 1, 0)))
+			board.add_wall(board.get_edge_id( \
+				board.get_node_id(i, self._height), board.get_node_id(i + 1, self._height)))
+				
+		for j in range(self._height):
+			board.add_wall(board.get_edge_id(board.get_node_id(0, j), board.get_node_id(0, j + 1)))
+			board.add_wall(board.get_edge_id( \
+				board.get_node_id(self._width, j), board.get_node_id(self._width, j + 1)))
 			
 		return board
 		
@@ -490,7 +1261,7 @@ class MapGenerator():
 		
 		rack_number = len(racks)
 		for i in range(rack_number):
-			rack_component = board.components[i].get_component_id()
+			rack_component = board.components.find(i)
 			rack = racks[i]
 			
 			# print("Placing rack {0}:{1} to component {2}".format(rack[1], rack[0], rack_component))
@@ -505,17 +1276,19 @@ class MapGenerator():
 			)
 			
 			for i in range(len(shifts)):
-				board.grid[rack[0] + shifts[i][0]][rack[1] + shifts[i][1]] = rack_component
-				board.walls.add(( \
-						(rack[0] + node_shifts[i][0][0], rack[1] + node_shifts[i][0][1]), \
-						(rack[0] + node_shifts[i][1][0], rack[1] + node_shifts[i][1][1]) \
+				board.set_component(
+					board.get_node_id(rack[0] + shifts[i][0], rack[1] + shifts[i][1]), rack_component)
+				board.add_wall(board.get_edge_id( \
+						board.get_node_id(rack[0] + node_shifts[i][0][0], rack[1] + node_shifts[i][0][1]), \
+						board.get_node_id(rack[0] + node_shifts[i][1][0], rack[1] + node_shifts[i][1][1]) \
 					))
 		
-		self._generate_border(board, rack_number)
+		# Component for the border
+		self._generate_border(board, board.components.make_set())
 			
 		return board
 		
-					
+		
 	def _arrange_racks(self, board, rack_number, component_number):
 		''' Arranges racks on the grid '''
 	
@@ -526,7 +1299,7 @@ class MapGenerator():
 		
 		self._merge_adjacent_components(board, racks)
 		
-		self._reduce_actual_components_number(board, racks, component_number)
+		self._reduce_actual_components_number(board, component_number)
 		
 		self._ensure_existance_of_cyclic_structures(board, racks)
 		
@@ -536,171 +1309,110 @@ class MapGenerator():
 		
 		
 	def _get_cells_by_components(self, board, rack_number):
-		''' Generates the dictionary of cells for each 
+		''' Generates the dictionary of node ids for each 
 			connectivity component (except empty cells and the border) '''
 			
 		components = collections.defaultdict(list)
-		for i in range(1, self.MAP_SIZE):
-			for j in range(1, self.MAP_SIZE):
-				if board.grid[i][j] != rack_number and \
-						board.grid[i][j] != MapRepresentation.EMPTY_CELL_COMPONENT_ID:
+		for i in range(1, self._width):
+			for j in range(1, self._height):
+				node_id = board.get_node_id(i, j)
+				component_id = board.get_component(node_id)
+				if component_id != rack_number and \
+						component_id != MapRepresentation.EMPTY_CELL_COMPONENT_ID:
 						
-					components[board.grid[i][j]].append((i, j))
+					components[component_id].append(node_id)
 		
 		return components
 		
 		
-	def _count_free_points(self, board, used, start_y, start_x, new_wall):
-		''' Counts the number of points which are reachable from given start point '''
-		
-		used[start_y][start_x] = True
-		result = 1
-		
-		shifts = ((0, 1), (1, 0), (-1, 0), (0, -1))
-		# Corresponding wall shifts
-		node_shifts = \
-			(
-				((0, 1), (1, 1)),
-				((1, 0), (1, 1)),
-				((0, 0), (0, 1)),
-				((0, 0), (1, 0))
-			)
-			
-		for i in range(len(shifts)):
-			coord_y = start_y + shifts[i][0]
-			coord_x = start_x + shifts[i][1]
-			
-			wall = ( \
-					(start_y + node_shifts[i][0][0], start_x + node_shifts[i][0][1]), \
-					(start_y + node_shifts[i][1][0], start_x + node_shifts[i][1][1]) \
-				   )
-			reversed_wall = (wall[1], wall[0])
-			
-			if not wall in board.walls and \
-					not reversed_wall in board.walls and \
-					wall != new_wall and \
-					reversed_wall != new_wall and \
-					not used[coord_y][coord_x]:
-				result += self._count_free_points(board, used, coord_y, coord_x, new_wall)
-		
-		return result
-		
-		
-	def _are_closed_structures_exists(self, board, new_wall):
-		''' Checks if there any closed wall structures on the board '''
+	def _are_closed_structures_exists(self, board, cell, new_cell):
+		''' Checks if there any closed wall structures on the board
+			after building the wall between given nodes '''
 	
-		used = []
-		start_point = (0, 0) # Cell coordinates
-		for i in range(self.MAP_SIZE):
-			used.append([])
-			for j in range(self.MAP_SIZE):
-				if not (i, j) in self._prohibited_start_points:
-					start_point = (i, j)
-					
-				used[i].append(False)
-				
-		expected_free_points = \
-			self.MAP_SIZE * self.MAP_SIZE - len(self._prohibited_start_points)
-		free_points = self._count_free_points(
-				board, 
-				used, 
-				start_point[0], 
-				start_point[1], 
-				new_wall)
-		
-		return expected_free_points != free_points
+		return self._wall_connectivity.is_closing(board, cell, new_cell)
 		
 		
-	def _get_new_wall_candidate(self, board, components):
+	def _get_new_wall_candidate(self, board, frontier):
 		'''
 		Selecting new cell adjacent with one of the connectivity components
 		'''
 		
-		connectivity_component_cells = random.choice(list(components.values()))
-		cell = random.choice(connectivity_component_cells)				
-		candidates = \
-			[
-				(cell[0] + 1, cell[1]), 
-				(cell[0] - 1, cell[1]), 
-				(cell[0], cell[1] + 1), 
-				(cell[0], cell[1] - 1)
-			]
-			
-		new_cell = random.choice(candidates)
+		return frontier.choose(self._random)
+		
 		
-		return (cell, new_cell)
-
-				
 	def _generate_walls(self, board, wall_number, rack_number):
 		''' Generates walls for the map with already
 			generated racks and connectivity components '''
 		
-		print("Generating {0} walls...".format(wall_number))
+		_logger.debug("Generating %d walls...", wall_number)
 	
 		components = self._get_cells_by_components(board, rack_number)
+		self._wall_connectivity = WallConnectivity(board, self._prohibited_start_points)
 		
-		# In order not to get infinite loop
 		available_cells = set()
-		for i in range(len(board.grid)):
-			for j in range(len(board.grid)):
-				if board.grid[i][j] == MapRepresentation.EMPTY_CELL_COMPONENT_ID:
-					available_cells.add((i, j))
+		for i in range(self._width + 1):
+			for j in range(self._height + 1):
+				node_id = board.get_node_id(i, j)
+				if board.get_component(node_id) == MapRepresentation.EMPTY_CELL_COMPONENT_ID:
+					available_cells.add(node_id)
+					
+		# Every candidate is checked once, so the loop is bounded 
+		# by the number of available cells
+		frontier = WallCandidateFrontier(board, components, available_cells)
 	
 		# Generating new walls
 		for i in range(wall_number):
 			is_wall_built = False
-			while not is_wall_built and len(available_cells) != 0:		
-				cell, new_cell = self._get_new_wall_candidate(board, components)
-				
-				if not new_cell in available_cells:
-					continue
+			while not is_wall_built and not frontier.is_empty():
+				cell, new_cell = self._get_new_wall_candidate(board, frontier)
 					
-				cell_id = board.grid[cell[0]][cell[1]]
-				new_cell_id = board.grid[new_cell[0]][new_cell[1]]
-				new_wall = (cell, new_cell)
+				cell_id = board.get_component(cell)
+				new_cell_id = board.get_component(new_cell)
+				frontier.remove_target(new_cell)
 			
+				# The frontier only offers empty nodes, so the checks of the other 
+				# components and closed structures are not reached at the moment
 				if new_cell_id == MapRepresentation.EMPTY_CELL_COMPONENT_ID or \
-						not board.components[new_cell_id].is_intercomponent_prohibited() and \
-						not board.components[cell_id].is_intercomponent_prohibited() and \
-						not self._are_closed_structures_exists(board, new_wall):
+						not board.components.is_intercomponent_prohibited(new_cell_id) and \
+						not board.components.is_intercomponent_prohibited(cell_id) and \
+						not self._are_closed_structures_exists(board, cell, new_cell):
 						
 					if new_cell_id == MapRepresentation.EMPTY_CELL_COMPONENT_ID:
-						board.grid[new_cell[0]][new_cell[1]] = board.grid[cell[0]][cell[1]]
-						
-						new_cell_id = board.grid[new_cell[0]][new_cell[1]]
-						components[new_cell_id].append(new_cell)
+						board.set_component(new_cell, cell_id)
+						frontier.add_node(cell_id, new_cell)
 
-					board.walls.add(new_wall)
+					board.add_wall(board.get_edge_id(cell, new_cell))
+					self._wall_connectivity.add_wall(cell, new_cell)
 					is_wall_built = True
+					self._count("built_walls")
 					
-				available_cells.discard(new_cell)
-			
-		self._walls = list(board.walls)
+		self._board = board
 		
 		
 	def _choose_start_points(self, restricted_cells):
-		''' Generates start points for the robot on the generated map '''
-	
-		print("Choosing start {0} points...".format(self.START_POINT_NUMBER))
+		''' Chooses distinct start points for the robot on the generated map.
+			Poses which look like many others need more moves to localize,
+			they are chosen with the weight ambiguity ** START_POINT_AMBIGUITY_BIAS '''
 	
-		start_points = set()
-		start_points_generated = 0
-		while (start_points_generated < self.START_POINT_NUMBER):
-			cell_x = random.randint(0, self.MAP_SIZE - 1)
-			cell_y = random.randint(0, self.MAP_SIZE - 1)
-			direction = random.choice((0, 90, -90, 180))
+		_logger.debug("Choosing %d start points...", self.START_POINT_NUMBER)
+		
+		self._signature_index = SensorSignatureIndex(self._board, restricted_cells)
+		
+		# Weighted sampling without replacement: every pose gets the key 
+		# u ** (1 / weight) and the poses with the largest keys are taken
+		keys = []
+		for pose in self._signature_index.get_poses():
+			weight = self._signature_index.get_ambiguity(pose) ** self.START_POINT_AMBIGUITY_BIAS
+			keys.append((self._random.random() ** (1.0 / weight), pose))
 			
-			if not (cell_x, cell_y) in restricted_cells:
-				start_points.add((cell_x, cell_y, direction))
-				start_points_generated += 1
-				
-		self._start_points = list(start_points)
+		keys.sort(reverse=True)
+		self._start_points = [pose for _, pose in keys[:self.START_POINT_NUMBER]]
+		
 		
-				
 	def _init_grid(self):
 		''' Initializes empty grid describing corners '''
 	
-		return MapRepresentation(self.MAP_SIZE)
+		return MapRepresentation(self._width, self._height)
 		
 	
 	def _generate_map(self, rack_number, component_number, wall_number):
@@ -708,33 +1420,106 @@ class MapGenerator():
 	
 		board = self._init_grid()
 		
-		racks = self._arrange_racks(board, rack_number, component_number)
-		self._generate_walls(board, wall_number, rack_number)
+		with self._measure("arrange_racks"):
+			racks = self._arrange_racks(board, rack_number, component_number)
+		with self._measure("generate_walls"):
+			self._generate_walls(board, wall_number, rack_number)
 		
-		self._choose_start_points(set(racks))	
+		with self._measure("choose_start_points"):
+			self._choose_start_points(set(racks))
+			
+			
+	def _measure(self, phase):
+		return self._metrics.measure(phase) if self._metrics is not None else contextlib.nullcontext()
+		
+		
+	def _count(self, counter):
+		if self._metrics is not None:
+			self._metrics.counters[counter] += 1
 		
 
-	def __init__(self):
-		''' Initializes the map generator and generates map '''
+	def _scale_to_area(self, number):
+		''' Scales the number given for the default grid to the area of the map '''
+		
+		return max(1, int(round(number * self._width * self._height / float(self.MAP_SIZE * self.MAP_SIZE))))
+		
+		
+	def __init__(self, random_generator=None, width=MAP_SIZE, height=MAP_SIZE, rack_number=None, wall_number=None, \
+			metrics=None):
+		''' Initializes the map generator and generates map of 
+			width x height cells using given random.Random instance,
+			rack and wall numbers are chosen randomly unless given,
+			phase times and counters are added to metrics if it is set '''
 	
-		self._walls = []
+		self._metrics = metrics
+		self._random = random_generator if random_generator is not None else random.Random()
+		self._width = width
+		self._height = height
+		self._board = None
 		self._start_points = []
 		self._prohibited_start_points = set()
-		
-		rack_number = random.randint(self.MIN_RACK_NUMBER, self.MAX_RACK_NUMBER)
-		connectivity_component_number = random.randint(self.MIN_RACK_NUMBER, rack_number)
-		wall_number = random.randint(self.MIN_WALLS_NUMBER, self.MAX_WALLS_NUMBER)
+		self._wall_connectivity = None
+		self._signature_index = None
+		# Set if the map is generated by from_seed()
+		self.seed = None
+		
+		min_rack_number = self._scale_to_area(self.MIN_RACK_NUMBER)
+		if rack_number is None:
+			rack_number = self._random.randint(min_rack_number, self._scale_to_area(self.MAX_RACK_NUMBER))
+		elif not 0 < rack_number < width * height:
+			# At least one cell is left for the start points
+			raise ValueError("Rack number must be in [1, {0}]".format(width * height - 1))
+			
+		connectivity_component_number = self._random.randint(min(min_rack_number, rack_number), rack_number)
+		if wall_number is None:
+			wall_number = self._random.randint( \
+				self._scale_to_area(self.MIN_WALLS_NUMBER), self._scale_to_area(self.MAX_WALLS_NUMBER))
 		
 		self._generate_map(rack_number, connectivity_component_number, wall_number)
 		
 
+	@classmethod
+	def from_seed(cls, seed, width=MAP_SIZE, height=MAP_SIZE, rack_number=None, wall_number=None, metrics=None):
+		''' Generates the map from the seed, the seed is kept 
+			in the seed attribute to reproduce the map '''
+			
+		generator = cls(random.Random(seed), width, height, rack_number, wall_number, metrics)
+		generator.seed = seed
+		
+		return generator
+		
+		
+	def get_size(self):
+		''' Returns (width, height) of the generated map in cells '''
+		
+		return (self._width, self._height)
+		
+		
+	def get_board(self):
+		''' Returns MapRepresentation of the generated map '''
+		
+		return self._board
+		
+		
+	def get_random_generator(self):
+		''' Returns random.Random instance of the generator, it continues the sequence used by the map '''
+		
+		return self._random
+		
+		
+	def get_racks(self):
+		''' Returns the set of (x, y) cells occupied by the racks '''
+		
+		return set(self._prohibited_start_points)
+		
+		
 	def get_walls(self):
 		''' Yields all walls on the generated map '''
 		
-		for wall in self._walls:
-			yield wall		
+		for edge_id in self._board.iter_wall_ids():
+			yield self._board.get_wall_nodes(edge_id)
+			
 			
-
 	def get_new_start_point(self):
 		''' Yields all start points on the generated map '''
 	
@@ -750,4 +1535,14 @@ class MapGenerator():
 	
 	
 		
-		
\ No newline at end of file
+		
+			
+			
+def iter_maps(seed, width=MapGenerator.MAP_SIZE, height=MapGenerator.MAP_SIZE, rack_number=None, wall_number=None, \
+		start=0, count=None):
+	''' Lazily yields the maps of the batch with given seed starting from the map
+		with index start, the batch is endless unless count is given '''
+		
+	map_indices = itertools.count(start) if count is None else range(start, start + count)
+	for map_index in map_indices:
+		yield MapGenerator.from_seed(get_map_seed(seed, map_index), width, height, rack_number, wall_number)
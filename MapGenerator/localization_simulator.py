@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import time
+from generator_import import *
+
+
+class LocalizationSimulator():
+	''' Simulates the robot on the map grid: the robot moves one cell forward
+		or turns by 90 degrees and sees the walls next to its cell in the 
+		directions of its sensors (see SensorSignatureIndex).
+		
+		Pose (x, y, direction) has index (x * height + y) * 4 + heading, 
+		heading k means direction 90 * k. Sets of poses are kept as bit masks '''
+		
+	HEADING_DIRECTIONS = (0, 90, 180, -90)
+	TURN_LEFT, TURN_RIGHT, FORWARD = range(3)
+	
+	def __init__(self, board, restricted_cells):
+		''' Initializes the simulator for the board with racks in restricted_cells '''
+		
+		self._width = board.width
+		self._height = board.height
+		
+		signature_index = SensorSignatureIndex(board, restricted_cells)
+		pose_number = self._width * self._height * 4
+		
+		# Signature of each pose, None for the racks
+		self._signatures = [None] * pose_number
+		self._signature_masks = collections.defaultdict(int)
+		self._heading_masks = [0] * 4
+		self._is_front_free = [False] * pose_number
+		
+		for index in range(pose_number):
+			self._heading_masks[index & 3] |= 1 << index
+			
+		for x, y, direction in signature_index.get_poses():
+			index = self.get_pose_index((x, y, direction))
+			signature = signature_index.get_signature((x, y, direction))
+			
+			self._signatures[index] = signature
+			self._signature_masks[signature] |= 1 << index
+			self._is_front_free[index] = not SensorSignatureIndex.has_wall(board, x, y, direction)
+			
+		# Pose index shift of the forward move for each heading
+		self._forward_shifts = (self._height * 4, 4, -self._height * 4, -4)
+		self._classes = None
+		
+		
+	def get_pose_index(self, pose):
+		x, y, direction = pose
+		return ((x * self._height + y) << 2) + self.HEADING_DIRECTIONS.index(direction if direction != 270 else -90)
+		
+		
+	def get_pose(self, index):
+		x, y = divmod(index >> 2, self._height)
+		return (x, y, self.HEADING_DIRECTIONS[index & 3])
+		
+		
+	def _move_pose(self, index, action):
+		''' Returns the index of the pose after the action, 
+			None if the robot can not move forward '''
+			
+		if action == self.TURN_LEFT:
+			return (index & ~3) | ((index - 1) & 3)
+		if action == self.TURN_RIGHT:
+			return (index & ~3) | ((index + 1) & 3)
+		if not self._is_front_free[index]:
+			return None
+			
+		return index + self._forward_shifts[index & 3]
+		
+		
+	def _move_mask(self, mask, action):
+		''' Applies the action to all poses of the mask, 
+			forward move must be possible for all of them '''
+			
+		first_heading, last_heading = self._heading_masks[0], self._heading_masks[3]
+		if action == self.TURN_LEFT:
+			return ((mask & ~first_heading) >> 1) | ((mask & first_heading) << 3)
+		if action == self.TURN_RIGHT:
+			return ((mask & ~last_heading) << 1) | ((mask & last_heading) >> 3)
+			
+		moved_mask = 0
+		for heading, shift in enumerate(self._forward_shifts):
+			heading_mask = mask & self._heading_masks[heading]
+			moved_mask |= heading_mask << shift if shift > 0 else heading_mask >> -shift
+			
+		return moved_mask
+		
+		
+	def _get_classes(self):
+		''' Splits the poses into classes of poses which can not be told apart
+			by any sequence of moves (Moore partition refinement) '''
+			
+		if self._classes is not None:
+			return self._classes
+			
+		poses = [index for index, signature in enumerate(self._signatures) if signature is not None]
+		classes = { index: self._signatures[index] for index in poses }
+		class_number = len(set(classes.values()))
+		
+		while True:
+			keys = {}
+			refined_classes = {}
+			for index in poses:
+				key = (classes[index],) + tuple( \
+					classes.get(self._move_pose(index, action)) for action in (self.TURN_LEFT, self.TURN_RIGHT, self.FORWARD))
+				refined_classes[index] = keys.setdefault(key, len(keys))
+				
+			classes = refined_classes
+			if len(keys) == class_number:
+				break
+			class_number = len(keys)
+			
+		self._classes = classes
+		return classes
+		
+		
+	def is_localizable(self, pose):
+		''' Checks if some sequence of moves tells the pose from all others '''
+		
+		index = self.get_pose_index(pose)
+		class_id = self._get_classes()[index]
+		
+		return sum(1 for other_class_id in self._classes.values() if other_class_id == class_id) == 1
+		
+		
+	def get_localization_moves(self, pose, max_moves=None):
+		''' Returns the minimum number of moves after which an ideal localizer 
+			knows the pose of the robot started from the given pose, None if
+			the pose can not be localized within max_moves '''
+			
+		if not self.is_localizable(pose):
+			return None
+			
+		index = self.get_pose_index(pose)
+		mask = self._signature_masks[self._signatures[index]]
+		
+		# Breadth-first search over (actual pose, poses consistent with the observations)
+		visited = { (index, mask) }
+		layer = [(index, mask)]
+		moves = 0
+		while layer:
+			next_layer = []
+			for index, mask in layer:
+				if mask & (mask - 1) == 0:
+					return moves
+					
+				for action in (self.TURN_LEFT, self.TURN_RIGHT, self.FORWARD):
+					moved_index = self._move_pose(index, action)
+					if moved_index is None:
+						continue
+						
+					state = (moved_index, self._move_mask(mask, action) & \
+						self._signature_masks[self._signatures[moved_index]])
+					if state not in visited:
+						visited.add(state)
+						next_layer.append(state)
+						
+			moves += 1
+			layer = next_layer
+			if max_moves is not None and moves > max_moves:
+				break
+				
+		return None
+		
+		
+	def _turn_actions(self, heading, target_heading):
+		''' Returns the turns which change the heading to target_heading '''
+		
+		return ((), (self.TURN_RIGHT,), (self.TURN_RIGHT, self.TURN_RIGHT), (self.TURN_LEFT,))[(target_heading - heading) & 3]
+		
+		
+	def get_exploration_moves(self, pose):
+		''' Returns (forward moves, quarter turns) of the robot which explores the free
+			cells depth-first from the pose until it is localized, None if the pose 
+			stays ambiguous after visiting all cells '''
+			
+		index = self.get_pose_index(pose)
+		mask = self._signature_masks[self._signatures[index]]
+		forward_moves = 0
+		turns = 0
+		
+		visited = { index >> 2 }
+		path = [index >> 2]
+		while mask & (mask - 1):
+			cell = index >> 2
+			# Unvisited cells are tried straight ahead first, then to the right, to the left and behind
+			headings = [(index + turn) & 3 for turn in (0, 1, 3, 2)]
+			target_headings = [heading for heading in headings if self._is_front_free[(cell << 2) | heading] and \
+				((cell << 2) + self._forward_shifts[heading]) >> 2 not in visited]
+				
+			if target_headings:
+				target_heading = target_headings[0]
+				path.append(((cell << 2) + self._forward_shifts[target_heading]) >> 2)
+				visited.add(path[-1])
+			else:
+				path.pop()
+				if not path:
+					return None
+					
+				target_heading = next(heading for heading in range(4) if self._is_front_free[(cell << 2) | heading] and \
+					((cell << 2) + self._forward_shifts[heading]) >> 2 == path[-1])
+					
+			for action in self._turn_actions(index & 3, target_heading) + (self.FORWARD,):
+				index = self._move_pose(index, action)
+				mask = self._move_mask(mask, action) & self._signature_masks[self._signatures[index]]
+				if action == self.FORWARD:
+					forward_moves += 1
+				else:
+					turns += 1
+					
+				if mask & (mask - 1) == 0:
+					break
+					
+		return (forward_moves, turns)
+		
+		
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Checks if the start points of generated maps can be localized")
+		
+		parser.add_argument("--width", type=int, default=MapGenerator.MAP_SIZE, metavar="W", help="map width in cells")
+		parser.add_argument("--height", type=int, default=MapGenerator.MAP_SIZE, metavar="H", help="map height in cells")
+		parser.add_argument("--count", type=int, default=100, metavar="N", help="number of maps to generate")
+		parser.add_argument("--seed", type=int, default=0, metavar="S", help="seed of the batch")
+		
+		return parser.parse_args(sys.argv[1:])
+		
+		
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+		
+		
+	def run(self):
+		arguments = self._parsed_arguments
+		
+		field_number = 0
+		unlocalizable_field_number = 0
+		moves = []
+		simulation_time = 0.0
+		
+		for generator in iter_maps(arguments.seed, arguments.width, arguments.height, count=arguments.count):
+			start_time = time.perf_counter()
+			simulator = LocalizationSimulator(generator.get_board(), generator.get_racks())
+			for point in generator.get_new_start_point():
+				field_number += 1
+				localization_moves = simulator.get_localization_moves(point)
+				if localization_moves is None:
+					unlocalizable_field_number += 1
+				else:
+					moves.append(localization_moves)
+			simulation_time += time.perf_counter() - start_time
+			
+		print("Fields: {0}, can not be localized: {1}".format(field_number, unlocalizable_field_number))
+		if moves:
+			moves.sort()
+			print("Localization moves: median {0}, max {1}".format(moves[len(moves) // 2], moves[-1]))
+		print("Simulated {0:.0f} fields/s".format(field_number / max(simulation_time, 1e-9)))
+		
+		
+if __name__ == "__main__":
+	simulator = Program()
+	simulator.run()
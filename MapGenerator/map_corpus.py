@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import struct
+from generator_import import *
+from localization_simulator import LocalizationSimulator
+
+
+class MapCorpus():
+	''' Read-only corpus of generated maps in one memory-mapped file.
+	
+		The file starts with a HEADER_SIZE bytes header followed by fixed-size
+		records, so the record of map i starts at HEADER_SIZE + i * record size.
+		Record: seed (uint64), number of start points (uint16), bit-packed walls 
+		as in MapRepresentation, bit-packed rack mask (bit x * height + y) and 
+		start poses (uint16, (x * height + y) * 4 + heading index in HEADINGS).
+		The header also keeps the generator options the fields are rendered with '''
+		
+	MAGIC = b"TRIKMAPS"
+	VERSION = 1
+	# Magic, version, width, height, maximum number of start points, record size, number of records,
+	# option flags, time limit slack. Corpora written without the options have zeros there
+	HEADER = struct.Struct("<8sHHHHIQHd")
+	HEADER_SIZE = 64
+	ADAPTIVE_TIME_LIMIT_FLAG = 1
+	COMPACT_CONSTRAINTS_FLAG = 2
+	RECORD_HEADER = struct.Struct("<QH")
+	HEADINGS = (0, 90, 180, -90)
+	
+	def __init__(self, path):
+		''' Opens the corpus file '''
+		
+		self._file = open(path, "rb")
+		self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		
+		magic, version, self.width, self.height, self.start_point_number, self.record_size, record_number, \
+			flags, self.time_limit_slack = self.HEADER.unpack_from(self._mmap)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError("{0} is not a map corpus of version {1}".format(path, self.VERSION))
+			
+		self.adaptive_time_limit = bool(flags & self.ADAPTIVE_TIME_LIMIT_FLAG)
+		self.compact_constraints = bool(flags & self.COMPACT_CONSTRAINTS_FLAG)
+			
+		# Records appended after the header was written are ignored
+		self._record_number = min(record_number, (len(self._mmap) - self.HEADER_SIZE) // self.record_size)
+		self._layout = self.get_record_layout(self.width, self.height, self.start_point_number)
+		
+		
+	@classmethod
+	def get_record_layout(cls, width, height, start_point_number):
+		''' Returns (offset, size) of the record parts: walls, racks, 
+			start points and the total record size aligned to 8 bytes '''
+			
+		board = MapRepresentation(width, height)
+		wall_size = len(board.get_wall_data())
+		rack_size = (width * height + 7) // 8
+		
+		wall_offset = cls.RECORD_HEADER.size
+		rack_offset = wall_offset + wall_size
+		start_point_offset = rack_offset + rack_size
+		record_size = start_point_offset + 2 * start_point_number
+		
+		return { 
+			"walls": (wall_offset, wall_size),
+			"racks": (rack_offset, rack_size),
+			"start_points": (start_point_offset, 2 * start_point_number),
+			"size": (record_size + 7) // 8 * 8
+		}
+		
+		
+	@classmethod
+	def encode_record(cls, width, height, start_point_number, seed, board, racks, start_points):
+		''' Returns the record of the map '''
+		
+		layout = cls.get_record_layout(width, height, start_point_number)
+		record = bytearray(layout["size"])
+		
+		start_points = list(start_points)[:start_point_number]
+		cls.RECORD_HEADER.pack_into(record, 0, seed, len(start_points))
+		
+		wall_offset, wall_size = layout["walls"]
+		record[wall_offset:wall_offset + wall_size] = board.get_wall_data()
+		
+		rack_offset = layout["racks"][0]
+		for x, y in racks:
+			bit = x * height + y
+			record[rack_offset + (bit >> 3)] |= 1 << (bit & 7)
+			
+		start_point_offset = layout["start_points"][0]
+		for k, (x, y, direction) in enumerate(start_points):
+			struct.pack_into("<H", record, start_point_offset + 2 * k, \
+				((x * height + y) << 2) + cls.HEADINGS.index(direction))
+				
+		return bytes(record)
+		
+		
+	def __len__(self):
+		return self._record_number
+		
+		
+	def close(self):
+		self._mmap.close()
+		self._file.close()
+		
+		
+	def __enter__(self):
+		return self
+		
+		
+	def __exit__(self, *arguments):
+		self.close()
+		
+		
+	def _get_record(self, map_id):
+		''' Returns the record as a memoryview of the mapped file '''
+		
+		if not 0 <= map_id < self._record_number:
+			raise IndexError("Map {0} is not in the corpus".format(map_id))
+			
+		offset = self.HEADER_SIZE + map_id * self.record_size
+		return memoryview(self._mmap)[offset:offset + self.record_size]
+		
+		
+	def get_seed(self, map_id):
+		return self.RECORD_HEADER.unpack_from(self._get_record(map_id))[0]
+		
+		
+	def get_board(self, map_id):
+		''' Returns MapRepresentation with the walls of the map '''
+		
+		wall_offset, wall_size = self._layout["walls"]
+		board = MapRepresentation(self.width, self.height)
+		board.set_wall_data(self._get_record(map_id)[wall_offset:wall_offset + wall_size])
+		
+		return board
+		
+		
+	def get_racks(self, map_id):
+		''' Returns the set of (x, y) cells occupied by the racks '''
+		
+		rack_offset, rack_size = self._layout["racks"]
+		rack_mask = self._get_record(map_id)[rack_offset:rack_offset + rack_size]
+		
+		return { divmod(bit, self.height) for bit in range(self.width * self.height) \
+			if rack_mask[bit >> 3] >> (bit & 7) & 1 }
+			
+			
+	def get_start_points(self, map_id):
+		''' Returns the list of (x, y, direction) start points '''
+		
+		record = self._get_record(map_id)
+		start_point_number = self.RECORD_HEADER.unpack_from(record)[1]
+		start_point_offset = self._layout["start_points"][0]
+		
+		start_points = []
+		for pose in struct.unpack_from("<{0}H".format(start_point_number), record, start_point_offset):
+			x, y = divmod(pose >> 2, self.height)
+			start_points.append((x, y, self.HEADINGS[pose & 3]))
+			
+		return start_points
+		
+		
+	def get_array(self):
+		''' Returns zero-copy numpy structured array of all records, requires numpy '''
+		
+		import numpy
+		
+		names = ["seed", "start_point_number"]
+		formats = ["<u8", "<u2"]
+		offsets = [0, 8]
+		for name in ("walls", "racks"):
+			offset, size = self._layout[name]
+			names.append(name)
+			formats.append(("u1", (size,)))
+			offsets.append(offset)
+			
+		names.append("start_points")
+		formats.append(("<u2", (self.start_point_number,)))
+		offsets.append(self._layout["start_points"][0])
+		
+		record_type = numpy.dtype({ "names": names, "formats": formats, "offsets": offsets, "itemsize": self.record_size })
+		return numpy.frombuffer(self._mmap, dtype=record_type, count=self._record_number, offset=self.HEADER_SIZE)
+		
+		
+	def render_field(self, map_id, point_index, deterministic_ids=True, time_limit=None, compact_constraints=None):
+		''' Returns xml of the field with the start point of given index, the time limit
+			and the constraints follow the options of the corpus unless given '''
+			
+		if compact_constraints is None:
+			compact_constraints = self.compact_constraints
+			
+		board = self.get_board(map_id)
+		racks = self.get_racks(map_id)
+		wrapper = TRIKMapWrapper(random.Random(self.get_seed(map_id)), deterministic_ids, self.width, self.height, \
+			racks if compact_constraints else ())
+		for edge_id in board.iter_wall_ids():
+			start_point, end_point = board.get_wall_nodes(edge_id)
+			wrapper.add_wall(start_point, end_point)
+			
+		point = self.get_start_points(map_id)[point_index]
+		if time_limit is None and self.adaptive_time_limit:
+			simulator = LocalizationSimulator(board, racks)
+			time_limit = TRIKMapWrapper.get_time_limit(simulator.get_exploration_moves(point), self.time_limit_slack)
+			
+		x, y, direction = point
+		return wrapper.compile_world().render((x, y), direction, time_limit)
+		
+		
+class MapCorpusWriter():
+	''' Appends records to the map corpus file '''
+	
+	def __init__(self, path, width, height, start_point_number=MapGenerator.START_POINT_NUMBER, \
+			adaptive_time_limit=False, time_limit_slack=TRIKMapWrapper.TIME_LIMIT_SLACK, compact_constraints=False):
+		''' Creates the corpus file for maps of width x height cells, the options
+			of the generated fields are stored for rendering them '''
+		
+		if width * height * 4 > 0xFFFF:
+			raise ValueError("Maps of {0}x{1} cells do not fit the corpus format".format(width, height))
+			
+		self.width = width
+		self.height = height
+		self.start_point_number = start_point_number
+		self.record_size = MapCorpus.get_record_layout(width, height, start_point_number)["size"]
+		self._record_number = 0
+		self._flags = (MapCorpus.ADAPTIVE_TIME_LIMIT_FLAG if adaptive_time_limit else 0) | \
+			(MapCorpus.COMPACT_CONSTRAINTS_FLAG if compact_constraints else 0)
+		self._time_limit_slack = time_limit_slack
+		
+		self._file = open(path, "wb")
+		self._write_header()
+		
+		
+	def _write_header(self):
+		header = MapCorpus.HEADER.pack(MapCorpus.MAGIC, MapCorpus.VERSION, self.width, self.height, \
+			self.start_point_number, self.record_size, self._record_number, self._flags, self._time_limit_slack)
+			
+		self._file.seek(0)
+		self._file.write(header.ljust(MapCorpus.HEADER_SIZE, b"\0"))
+		self._file.seek(0, os.SEEK_END)
+		
+		
+	def append_record(self, record):
+		''' Appends the record returned by MapCorpus.encode_record(), returns the map id '''
+		
+		if len(record) != self.record_size:
+			raise ValueError("Record size {0} does not match the corpus".format(len(record)))
+			
+		self._file.write(record)
+		self._record_number += 1
+		
+		return self._record_number - 1
+		
+		
+	def append(self, seed, board, racks, start_points):
+		''' Appends the map, returns its id '''
+		
+		return self.append_record(MapCorpus.encode_record(self.width, self.height, self.start_point_number, \
+			seed, board, racks, start_points))
+			
+			
+	def close(self):
+		self._write_header()
+		self._file.close()
+		
+		
+	def __enter__(self):
+		return self
+		
+		
+	def __exit__(self, *arguments):
+		self.close()
+		
+		
+class Program():
+	def _init_help(self):
+		parser = argparse.ArgumentParser(description="Shows the map corpus and renders its fields")
+		
+		parser.add_argument("corpus", metavar="CORPUS", help="corpus file")
+		parser.add_argument("--export", default=None, metavar="PATH", help="folder to save the fields of the maps")
+		parser.add_argument("--maps", type=int, nargs="+", default=[], metavar="ID", help="ids of the exported maps")
+		
+		return parser.parse_args(sys.argv[1:])
+		
+		
+	def __init__(self):
+		self._parsed_arguments = self._init_help()
+		
+		
+	def run(self):
+		arguments = self._parsed_arguments
+		
+		with MapCorpus(arguments.corpus) as corpus:
+			print("Maps: {0}, size {1}x{2}, record size {3} bytes".format( \
+				len(corpus), corpus.width, corpus.height, corpus.record_size))
+				
+			if arguments.export is None:
+				return
+				
+			os.makedirs(arguments.export, exist_ok=True)
+			for map_id in arguments.maps:
+				for point_index in range(len(corpus.get_start_points(map_id))):
+					save_path = os.path.join(arguments.export, "field_{0}_{1}.xml".format(map_id, point_index))
+					with open(save_path, "wb") as field_file:
+						field_file.write(corpus.render_field(map_id, point_index))
+						
+						
+if __name__ == "__main__":
+	corpus = Program()
+	corpus.run()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import os
+from generator_import import *
+
+
+class MapSymmetry():
+	''' Canonical form of the maps of width x height cells under the symmetries
+		of the grid: rotations and reflections of the square (8 for square maps,
+		4 otherwise). Maps which differ only by a symmetry get the same key,
+		maps of different sizes never do '''
+		
+	HEADINGS = (0, 90, 180, -90)
+	HEADING_VECTORS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+	KEY_SIZE = 16 # bytes
+	
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		
+		self._board = MapRepresentation(width, height)
+		self._edge_number = (width + 1) * (height + 1) * 2
+		self._key_size = (self._edge_number + width * height + 7) // 8
+		self._size_prefix = width.to_bytes(2, "little") + height.to_bytes(2, "little")
+		
+		# Every symmetry is (swap axes, flip x, flip y) applied in this order
+		symmetries = [(swap, flip_x, flip_y) for swap in (False, True) \
+			for flip_x in (False, True) for flip_y in (False, True) if not swap or width == height]
+			
+		self._edge_permutations = [self._get_edge_permutation(symmetry) for symmetry in symmetries]
+		self._cell_permutations = [self._get_cell_permutation(symmetry) for symmetry in symmetries]
+		self._pose_permutations = [self._get_pose_permutation(symmetry, cell_permutation) \
+			for symmetry, cell_permutation in zip(symmetries, self._cell_permutations)]
+			
+			
+	def _transform_point(self, symmetry, x, y):
+		''' Transforms the point given in doubled coordinates (nodes are even, cell centres are odd) '''
+		
+		swap, flip_x, flip_y = symmetry
+		if swap:
+			x, y = y, x
+		if flip_x:
+			x = 2 * self.width - x
+		if flip_y:
+			y = 2 * self.height - y
+			
+		return (x, y)
+		
+		
+	def _get_edge_permutation(self, symmetry):
+		permutation = {}
+		for i in range(self.width + 1):
+			for j in range(self.height + 1):
+				node_id = self._board.get_node_id(i, j)
+				for adjacent_node_id in self._board.get_adjacent_node_ids(node_id):
+					ends = [self._transform_point(symmetry, 2 * x, 2 * y) \
+						for x, y in (self._board.get_node(node_id), self._board.get_node(adjacent_node_id))]
+						
+					permutation[self._board.get_edge_id(node_id, adjacent_node_id)] = self._board.get_edge_id( \
+						*(self._board.get_node_id(x // 2, y // 2) for x, y in ends))
+						
+		return permutation
+		
+		
+	def _get_cell_permutation(self, symmetry):
+		permutation = []
+		for x in range(self.width):
+			for y in range(self.height):
+				new_x, new_y = self._transform_point(symmetry, 2 * x + 1, 2 * y + 1)
+				permutation.append(new_x // 2 * self.height + new_y // 2)
+				
+		return permutation
+		
+		
+	def _get_pose_permutation(self, symmetry, cell_permutation):
+		''' Pose (x, y, direction) has index (x * height + y) * 4 + heading index '''
+		
+		swap, flip_x, flip_y = symmetry
+		heading_permutation = []
+		for dx, dy in self.HEADING_VECTORS:
+			if swap:
+				dx, dy = dy, dx
+			heading_permutation.append(self.HEADING_VECTORS.index((-dx if flip_x else dx, -dy if flip_y else dy)))
+			
+		return [cell_permutation[pose >> 2] * 4 + heading_permutation[pose & 3] \
+			for pose in range(4 * self.width * self.height)]
+			
+			
+	def get_pose_index(self, pose):
+		x, y, direction = pose
+		return (x * self.height + y) * 4 + self.HEADINGS.index(direction)
+		
+		
+	def get_canonical_form(self, board, racks):
+		''' Returns the map size followed by the smallest encoding of the walls and racks 
+			among all symmetries and the indices of the symmetries which give it '''
+			
+		wall_ids = list(board.iter_wall_ids())
+		cells = [x * self.height + y for x, y in racks]
+		
+		forms = []
+		for edge_permutation, cell_permutation in zip(self._edge_permutations, self._cell_permutations):
+			form = 0
+			for edge_id in wall_ids:
+				form |= 1 << edge_permutation[edge_id]
+			for cell in cells:
+				form |= 1 << (self._edge_number + cell_permutation[cell])
+			forms.append(form)
+			
+		canonical_form = min(forms)
+		symmetries = [k for k, form in enumerate(forms) if form == canonical_form]
+		
+		return (self._size_prefix + canonical_form.to_bytes(self._key_size, "little"), symmetries)
+		
+		
+	def get_map_key(self, board, racks):
+		return hashlib.blake2b(self.get_canonical_form(board, racks)[0], digest_size=self.KEY_SIZE).digest()
+		
+		
+	def get_pose_keys(self, board, racks, poses):
+		''' Returns the keys of (map, start pose) pairs, the pairs which 
+			differ only by a symmetry get the same key '''
+			
+		canonical_form, symmetries = self.get_canonical_form(board, racks)
+		
+		keys = []
+		for pose in poses:
+			pose_index = self.get_pose_index(pose)
+			# The map may be symmetric itself, so its poses are also reduced 
+			# over all symmetries which give the canonical form
+			canonical_pose = min(self._pose_permutations[k][pose_index] for k in symmetries)
+			keys.append(hashlib.blake2b(canonical_form + canonical_pose.to_bytes(4, "little"), \
+				digest_size=self.KEY_SIZE).digest())
+				
+		return keys
+		
+		
+class DedupIndex():
+	''' Set of map keys, kept in memory and appended to the file if the path is set.
+		Keys are stored to the file only by record(), after their fields are written '''
+	
+	def __init__(self, path=None):
+		self._keys = set()
+		self._file = None
+		
+		if path is not None:
+			if os.path.exists(path):
+				with open(path, "rb") as index_file:
+					data = index_file.read()
+					
+				# Incomplete last key is dropped
+				key_size = MapSymmetry.KEY_SIZE
+				self._keys.update(data[i:i + key_size] for i in range(0, len(data) - key_size + 1, key_size))
+				
+			self._file = open(path, "ab")
+			
+			
+	def __len__(self):
+		return len(self._keys)
+		
+		
+	def __contains__(self, key):
+		return key in self._keys
+		
+		
+	def add(self, key):
+		''' Adds the key to the memory, returns False if it is already in the index '''
+		
+		if key in self._keys:
+			return False
+			
+		self._keys.add(key)
+		return True
+		
+		
+	def record(self, keys):
+		''' Stores the added keys to the file, so the next batches skip them '''
+		
+		if self._file is not None:
+			self._file.write(b"".join(keys))
+			self._file.flush()
+		
+		
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			
+			
+	def __enter__(self):
+		return self
+		
+		
+	def __exit__(self, *arguments):
+		self.close()
@@ -0,0 +1,46 @@
+#!/bin/bash
+# Stand-in for trikStudio-checker/bin/check-solution.sh which does not need TRIK Studio.
+# Usage: fake_check_solution.sh PROJECT.qrs SOLUTION.js
+#
+# Like the real checker it takes fields from <checker root>/fields/<project name>
+# and writes one report per field to ./reports/<project name>.
+#
+# FAKE_CHECKER_FAIL   - glob of field names which fail (nothing fails by default)
+# FAKE_CHECKER_DELAY  - real checking time of one field in seconds (0 by default)
+#
+# Reports also carry a made-up simulated time in ms derived from the field name.
+
+project_file=$1
+solution_file=$2
+
+if ! [ -f "$project_file" ] || ! [ -f "$solution_file" ]; then
+    echo "Usage: $0 PROJECT.qrs SOLUTION.js" >&2
+    exit 1
+fi
+
+project_name=$(basename "$project_file" .qrs)
+field_path="$(dirname "$project_file")/../fields/$project_name"
+report_path="./reports/$project_name"
+
+mkdir -p "$report_path"
+
+for field in "$field_path"/*.xml; do
+    [ -f "$field" ] || continue
+    field_name=$(basename "$field" .xml)
+
+    sleep "${FAKE_CHECKER_DELAY:-0}"
+
+    if [ -n "$FAKE_CHECKER_FAIL" ] && [[ $field_name == $FAKE_CHECKER_FAIL ]]; then
+        message="Обнаружено читерство!"
+        level="error"
+    else
+        message="Задание выполнено!"
+        level="info"
+    fi
+
+    simulated_time=$(( $(echo "$field_name" | cksum | cut -d ' ' -f 1) % 60000 ))
+
+    echo "[{\"level\": \"$level\", \"message\": \"$message\", \"time\": $simulated_time}]" > "$report_path/$field_name"
+done
+
+echo "[{\"level\": \"info\", \"message\": \"$project_name\"}]" > "$report_path/_$project_name"
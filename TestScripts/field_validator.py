@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import argparse
+import collections
+import multiprocessing
+import xml.etree.ElementTree as xml
+
+class FieldValidator():
+    '''
+    Checks generated TRIK Studio fields against the invariants of the field generator
+    '''
+
+    CELL_WIDTH = 200
+    CELL_HEIGHT = 200
+
+    CELL_REGION_ID = re.compile(r"^\((\d+),(\d+)\)$")
+    START_REGION_ID = "start"
+    # Errors of the same kind reported for one field
+    MAX_EXAMPLES = 3
+
+    def __init__(self, path):
+        '''
+        Initializes new instance of FieldValidator() for the field file
+        '''
+
+        self.path = path
+        self.errors = []
+
+        self.width = 0
+        self.height = 0
+
+        self._walls = []
+        self._regions = {}
+        self._start_point = None
+        self._event_regions = []
+        self._has_time_limit = False
+
+        # Unit grid segment -> list of covered intervals
+        self._coverage = collections.defaultdict(list)
+        self._closed_segments = set()
+
+    def _parse(self):
+        '''
+        Reads the field with iterparse dropping the elements which are already processed
+        '''
+
+        for _, element in xml.iterparse(self.path, events=("end",)):
+            if element.tag == "wall":
+                self._walls.append((self._parse_point(element.get("begin")),
+                                    self._parse_point(element.get("end"))))
+            elif element.tag == "region":
+                self._regions[element.get("id")] = tuple(
+                    float(element.get(key, "nan")) for key in ("x", "y", "width", "height"))
+            elif element.tag == "startPosition":
+                self._start_point = (float(element.get("x")), float(element.get("y")))
+            elif element.tag == "timelimit":
+                self._has_time_limit = True
+            elif element.tag == "event":
+                self._event_regions.append(
+                    [inside.get("regionId") for inside in element.iter("inside")])
+            else:
+                continue
+
+            element.clear()
+
+    @staticmethod
+    def _parse_point(point):
+        x, y = point.split(":")
+        return (float(x), float(y))
+
+    def _add_error(self, message, examples=()):
+        examples = list(examples)
+        if examples:
+            message += ": " + ", ".join(str(example) for example in examples[:self.MAX_EXAMPLES])
+            if len(examples) > self.MAX_EXAMPLES:
+                message += " and {0} more".format(len(examples) - self.MAX_EXAMPLES)
+
+        self.errors.append(message)
+
+    def _init_size(self):
+        '''
+        Takes the grid size from the cell regions, compact fields have no regions
+        in the rack cells, so the size is extended to them after the walls are read
+        '''
+
+        cells = [tuple(map(int, match.groups())) for match in
+                 (self.CELL_REGION_ID.match(region_id) for region_id in self._regions) if match]
+
+        if not cells:
+            self._add_error("No cell regions")
+            return False
+
+        self.width = max(cell[0] + 1 for cell in cells)
+        self.height = max(cell[1] + 1 for cell in cells)
+        return True
+
+    def _extend_size_to_racks(self):
+        '''
+        Adds the columns and rows after the cell regions which consist of racks only
+        '''
+
+        is_extended = True
+        while is_extended:
+            is_extended = False
+            if all(self._is_rack((self.width, j)) for j in range(self.height)):
+                self.width += 1
+                is_extended = True
+            if all(self._is_rack((i, self.height)) for i in range(self.width)):
+                self.height += 1
+                is_extended = True
+
+    def _is_rack(self, cell):
+        '''
+        Racks are the cells closed from all sides
+        '''
+
+        return len(self._get_open_neighbours(cell)) == 0
+
+    def _check_regions(self):
+        missing_regions = []
+        misplaced_regions = []
+        for i in range(self.width):
+            for j in range(self.height):
+                region_id = "({0},{1})".format(i, j)
+                if region_id not in self._regions:
+                    # Compact fields omit the cells which the robot can not enter
+                    if not self._is_rack((i, j)):
+                        missing_regions.append(region_id)
+                elif self._regions[region_id] != (i * self.CELL_WIDTH, j * self.CELL_HEIGHT,
+                                                  self.CELL_WIDTH, self.CELL_HEIGHT):
+                    misplaced_regions.append(region_id)
+
+        if missing_regions:
+            self._add_error("Missing cell regions", missing_regions)
+        if misplaced_regions:
+            self._add_error("Cell regions do not match the cells", misplaced_regions)
+        if self.START_REGION_ID not in self._regions:
+            self._add_error("Missing start region")
+
+    def _check_constraints(self):
+        if not self._has_time_limit:
+            self._add_error("Missing time limit")
+
+        # Every cell region has the success event and the cheating event
+        cell_region_number = sum(1 for region_id in self._regions if self.CELL_REGION_ID.match(region_id))
+        expected_event_number = 2 * cell_region_number
+        if len(self._event_regions) != expected_event_number:
+            self._add_error("Expected {0} events, found {1}".format(
+                expected_event_number, len(self._event_regions)))
+
+        event_numbers = collections.Counter(
+            region_id for regions in self._event_regions for region_id in regions)
+        cells_without_events = ["({0},{1})".format(i, j)
+                                for i in range(self.width) for j in range(self.height)
+                                if event_numbers["({0},{1})".format(i, j)] < 2 and not self._is_rack((i, j))]
+        if cells_without_events:
+            self._add_error("Cells without success and fail events", cells_without_events)
+
+    def _add_coverage(self, is_horizontal, line, begin, end):
+        '''
+        Marks the part of the grid line covered by the wall
+        '''
+
+        cell_length = self.CELL_WIDTH if is_horizontal else self.CELL_HEIGHT
+        for index in range(int(begin // cell_length), int(-(-end // cell_length))):
+            segment_begin = max(begin, index * cell_length)
+            segment_end = min(end, (index + 1) * cell_length)
+            if segment_begin < segment_end:
+                self._coverage[(is_horizontal, line, index)].append((segment_begin, segment_end))
+
+    def _check_walls(self):
+        walls = collections.Counter()
+        grid_walls = []
+        off_grid_walls = []
+
+        for begin, end in self._walls:
+            begin, end = min(begin, end), max(begin, end)
+            walls[(begin, end)] += 1
+
+            if begin[1] == end[1] and begin[1] % self.CELL_HEIGHT == 0:
+                self._add_coverage(True, int(begin[1] // self.CELL_HEIGHT), begin[0], end[0])
+                grid_walls.append((begin, end))
+            elif begin[0] == end[0] and begin[0] % self.CELL_WIDTH == 0:
+                self._add_coverage(False, int(begin[0] // self.CELL_WIDTH), begin[1], end[1])
+                grid_walls.append((begin, end))
+            else:
+                off_grid_walls.append((begin, end))
+
+        self._find_closed_segments()
+        self._extend_size_to_racks()
+
+        grid_width = self.width * self.CELL_WIDTH
+        grid_height = self.height * self.CELL_HEIGHT
+        outside_walls = [wall for wall in grid_walls + off_grid_walls
+                         if not all(0 <= point[0] <= grid_width and 0 <= point[1] <= grid_height for point in wall)]
+
+        if outside_walls:
+            self._add_error("Walls outside the grid", outside_walls)
+
+        off_grid_walls = [wall for wall in off_grid_walls if wall not in outside_walls]
+        if off_grid_walls:
+            self._add_error("Walls not on the grid lines", off_grid_walls)
+
+        duplicate_walls = [wall for wall, number in walls.items() if number > 1]
+        if duplicate_walls:
+            self._add_error("Duplicate walls", duplicate_walls)
+
+    def _find_closed_segments(self):
+        '''
+        Segment is closed if the walls cover it completely
+        '''
+
+        for segment, intervals in self._coverage.items():
+            cell_length = self.CELL_WIDTH if segment[0] else self.CELL_HEIGHT
+            covered_end = segment[2] * cell_length
+            for begin, end in sorted(intervals):
+                if begin > covered_end:
+                    break
+                covered_end = max(covered_end, end)
+
+            if covered_end >= (segment[2] + 1) * cell_length:
+                self._closed_segments.add(segment)
+
+    def _is_closed(self, is_horizontal, line, index):
+        return (is_horizontal, line, index) in self._closed_segments
+
+    def _get_open_neighbours(self, cell):
+        '''
+        Returns the cells reachable from the cell in one move
+        '''
+
+        i, j = cell
+        neighbours = []
+        if not self._is_closed(False, i, j):
+            neighbours.append((i - 1, j))
+        if not self._is_closed(False, i + 1, j):
+            neighbours.append((i + 1, j))
+        if not self._is_closed(True, j, i):
+            neighbours.append((i, j - 1))
+        if not self._is_closed(True, j + 1, i):
+            neighbours.append((i, j + 1))
+
+        return neighbours
+
+    def _check_border(self):
+        open_segments = ["top {0}".format(i) for i in range(self.width) if not self._is_closed(True, 0, i)] + \
+            ["bottom {0}".format(i) for i in range(self.width) if not self._is_closed(True, self.height, i)] + \
+            ["left {0}".format(j) for j in range(self.height) if not self._is_closed(False, 0, j)] + \
+            ["right {0}".format(j) for j in range(self.height) if not self._is_closed(False, self.width, j)]
+
+        if open_segments:
+            self._add_error("Border is not closed", open_segments)
+
+        return not open_segments
+
+    def _check_free_cells(self):
+        '''
+        Checks that the cells which are not racks are connected
+        and the start point is in one of them
+        '''
+
+        # Racks are the cells closed from all sides
+        free_cells = {(i, j) for i in range(self.width) for j in range(self.height)
+                      if len(self._get_open_neighbours((i, j))) != 0}
+
+        if self._start_point is None:
+            self._add_error("Missing start position")
+            return
+
+        start_cell = (int(self._start_point[0] // self.CELL_WIDTH), int(self._start_point[1] // self.CELL_HEIGHT))
+        if not (0 <= start_cell[0] < self.width and 0 <= start_cell[1] < self.height):
+            self._add_error("Start position is outside the grid: {0}".format(start_cell))
+            return
+        if start_cell not in free_cells:
+            self._add_error("Start position is inside a rack: {0}".format(start_cell))
+            return
+
+        used = {start_cell}
+        stack = [start_cell]
+        while stack:
+            for neighbour in self._get_open_neighbours(stack.pop()):
+                if neighbour in free_cells and neighbour not in used:
+                    used.add(neighbour)
+                    stack.append(neighbour)
+
+        unreachable_cells = sorted(free_cells - used)
+        if unreachable_cells:
+            self._add_error("Cells unreachable from the start", unreachable_cells)
+
+    def validate(self):
+        '''
+        Returns the list of errors found in the field
+        '''
+
+        try:
+            self._parse()
+        except (xml.ParseError, ValueError, AttributeError) as error:
+            self._add_error("Field is not readable: {0}".format(error))
+            return self.errors
+
+        if self._init_size():
+            # Racks are known after the walls are checked
+            self._check_walls()
+            self._check_regions()
+            self._check_constraints()
+            if self._check_border():
+                self._check_free_cells()
+
+        return self.errors
+
+
+def validate_field(path):
+    return (path, FieldValidator(path).validate())
+
+
+def get_field_paths(paths):
+    field_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            field_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".xml"))
+        else:
+            field_paths.append(path)
+
+    return field_paths
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Checks generated fields before running the checker")
+
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="field files or folders with the fields")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, metavar="J",
+                        help="number of worker processes")
+    parser.add_argument("--min-parallel-fields", type=int, default=64, metavar="N",
+                        help="smaller sets of fields are checked in one process")
+
+    return parser.parse_args(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    field_paths = get_field_paths(arguments.paths)
+
+    if arguments.jobs > 1 and len(field_paths) >= arguments.min_parallel_fields:
+        with multiprocessing.Pool(arguments.jobs) as pool:
+            results = list(pool.imap(validate_field, field_paths, chunksize=16))
+    else:
+        results = [validate_field(path) for path in field_paths]
+
+    invalid_field_number = 0
+    for path, errors in results:
+        if errors:
+            invalid_field_number += 1
+            print("Field {0} is invalid:".format(path))
+            for error in errors:
+                print("    " + error)
+
+    print("Checked {0} fields, invalid: {1}".format(len(field_paths), invalid_field_number))
+
+    if (invalid_field_number != 0):
+        exit(1)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import tempfile
+
+class ResultCache():
+    '''
+    Size-bounded on-disk store of checker results addressed by the hashes
+    of the solution, the field and the checker version,
+    least recently used results are evicted first
+    '''
+
+    RESULT_EXTENSION = ".json"
+    # Part of the limit which stays occupied after the eviction
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path, max_size):
+        '''
+        Initializes the cache in the folder path which holds at most max_size bytes
+        '''
+
+        self._path = path
+        self._max_size = max_size
+        # Computed on the first store
+        self._size = None
+
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def get_file_hash(path):
+        '''
+        Returns the hash of the file content
+        '''
+
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 16), b""):
+                file_hash.update(block)
+
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def get_folder_fingerprint(paths):
+        '''
+        Returns the hash of the names, sizes and modification times of the files in the folders,
+        missing folders are skipped
+        '''
+
+        fingerprint = hashlib.sha256()
+        for path in paths:
+            for folder, folder_names, file_names in os.walk(path):
+                folder_names.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(folder, file_name)
+                    try:
+                        stat = os.stat(file_path)
+                    except FileNotFoundError:
+                        continue
+
+                    fingerprint.update("{0}:{1}:{2};".format(
+                        os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns).encode("utf8"))
+
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def get_key(solution_hash, field_hash, checker_version):
+        '''
+        Returns the key of the result of the solution on the field
+        '''
+
+        return hashlib.sha256("{0}/{1}/{2}".format(
+            solution_hash, field_hash, checker_version).encode("utf8")).hexdigest()
+
+    def _get_result_path(self, key):
+        return os.path.join(self._path, key[:2], key + self.RESULT_EXTENSION)
+
+    def _list_results(self):
+        '''
+        Returns (last access time, size, path) for each stored result
+        '''
+
+        results = []
+        for folder in os.scandir(self._path):
+            if not folder.is_dir():
+                continue
+
+            for entry in os.scandir(folder.path):
+                if not entry.name.endswith(self.RESULT_EXTENSION):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process
+                    continue
+
+                results.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return results
+
+    def _evict(self):
+        '''
+        Removes least recently used results until the cache fits its limit
+        '''
+
+        results = self._list_results()
+        results.sort()
+
+        self._size = sum(size for access_time, size, path in results)
+        target_size = self._max_size * self.EVICTION_TARGET
+        for access_time, size, path in results:
+            if self._size <= target_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            self._size -= size
+
+    def get(self, key):
+        '''
+        Returns the stored result or None if it is missing
+        '''
+
+        path = self._get_result_path(key)
+        try:
+            with open(path, "r") as result_file:
+                result = json.load(result_file)
+
+            # Modification time is used as the last access time
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return result
+
+    def put(self, key, result):
+        '''
+        Stores the JSON-serializable result with given key
+        '''
+
+        data = json.dumps(result, ensure_ascii=False).encode("utf8")
+        if len(data) > self._max_size:
+            return
+
+        if self._size is None:
+            self._size = sum(size for access_time, size, path in self._list_results())
+
+        path = self._get_result_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # The result appears atomically for concurrent readers
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, "wb") as result_file:
+            result_file.write(data)
+
+        # Overwritten result with the same key is not counted twice
+        try:
+            self._size -= os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+        os.replace(temporary_path, path)
+
+        self._size += len(data)
+        if self._size > self._max_size:
+            self._evict()
@@ -2,36 +2,75 @@
 set -e
 
 volume_name=trik-checker-sandbox
+container_name=trik-checker
+spool_path=/trikStudio-checker/launch_scripts/spool
 
 function prepare_docker_image {
-    echo "Downloading and setting up a docker image..."
-    sudo docker build -t checker https://github.com/anastasiia-kornilova/epicbox-images.git#xenial:/epicbox-trik -f Dockerfile.xenial
+    # Image and checker rig are reused by the next runs
+    if ! sudo docker image inspect checker > /dev/null 2>&1 ; then
+        echo "Downloading and setting up a docker image..."
+        sudo docker build -t checker https://github.com/anastasiia-kornilova/epicbox-images.git#xenial:/epicbox-trik -f Dockerfile.xenial
+    fi
 
     sudo docker volume create "$volume_name"
     volume_path=$(sudo docker volume inspect $volume_name --format '{{.Mountpoint}}')
     
-    echo "Downloading checker rig..."
-    sudo svn checkout https://github.com/ibalashov24/semester_4_coursework/trunk/TestScripts $volume_path/TestScripts
+    if ! [ -d $volume_path/TestScripts ] ; then
+        echo "Downloading checker rig..."
+        sudo svn checkout https://github.com/ibalashov24/semester_4_coursework/trunk/TestScripts $volume_path/TestScripts
+    else
+        echo "Updating checker rig..."
+        sudo svn update $volume_path/TestScripts
+    fi
 
     sudo cp -a "$volume_path/TestScripts/." "$volume_path"
     
     echo "Preparing user solution file..."
     sudo cp ./solution.js $volume_path/solution.js
     
-    if  [ -d ./test_fields ] && ! [ `ls ./test_fields | wc -l` -eq 0 ] ; then.
-    <-->echo "Preparing user fields..."
-    <-->sudo cp -r ./test_fields/. $volume_path/custom_fields
-     else
-    <-->echo "Fields not found in ./test_fields !!!"
-    <-->exit 1
+    if  [ -d ./test_fields ] && ! [ `ls ./test_fields | wc -l` -eq 0 ] ; then
+        echo "Preparing user fields..."
+        sudo rm -rf $volume_path/custom_fields
+        sudo cp -r ./test_fields/. $volume_path/custom_fields
+    else
+        echo "Fields not found in ./test_fields !!!"
+        exit 1
     fi
 }
 
+function start_daemon {
+    # Daemon keeps the checker fields prepared, it is restarted when the fields or the rig change
+    rig_hash=$(sudo cat $volume_path/custom_fields/* $volume_path/TestScripts/*.py $volume_path/TestScripts/*.sh | md5sum | cut -d ' ' -f 1)
+
+    if [ "$(sudo docker inspect -f '{{.State.Running}} {{index .Config.Labels "rig"}}' $container_name 2> /dev/null)" == "true $rig_hash" ] ; then
+        echo "Reusing running checker daemon"
+        return
+    fi
+
+    sudo docker rm -f $container_name > /dev/null 2>&1 || true
+
+    echo "Launching checker daemon container"
+    command="bash /trikStudio-checker/launch_scripts/start_testing.sh --daemon --spool $spool_path"
+    sudo docker run -d --name $container_name --label rig=$rig_hash -e PYTHONUNBUFFERED=1 \
+        -v $volume_name:/trikStudio-checker/launch_scripts checker $command > /dev/null
+
+    # Fields are validated and prepared before the daemon starts waiting for solutions
+    until sudo docker logs $container_name 2>&1 | grep -q "Waiting for solutions" ; do
+        if [ "$(sudo docker inspect -f '{{.State.Running}}' $container_name)" != "true" ] ; then
+            sudo docker logs $container_name
+            echo "Checker daemon stopped!!!"
+            exit 1
+        fi
+        sleep 1
+    done
+}
+
 function run_testing {
-    command="bash /trikStudio-checker/launch_scripts/start_testing.sh"
-    
-    echo "Launching Docker container"
-    sudo docker run -i --name trik-checker -v $volume_name:/trikStudio-checker/launch_scripts checker $command
+    start_daemon
+
+    echo "Submitting solution to the checker daemon"
+    sudo docker exec $container_name python3 /trikStudio-checker/launch_scripts/solution_tester.py \
+        --submit /trikStudio-checker/launch_scripts/solution.js --spool $spool_path
 }
 
 prepare_docker_image
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import json
+import time
 import shutil
-from subprocess import run
+import uuid
+import signal
+import argparse
+import xml.etree.ElementTree as xml
+from subprocess import Popen
+from result_cache import ResultCache
 
 class SolutionTester():
     CHECKER_PATH = '/trikStudio-checker/bin/check-solution.sh'
@@ -12,66 +19,630 @@ class SolutionTester():
     REPORT_FILE_PATH = './reports/randomizer'
     FIELD_GENERATOR_PATH = '/trikStudio-checker/launch_scripts/generator.py'
 
-    def __init__(self):
+    SUCCESS_MESSAGE = "Задание выполнено!"
+    CORRUPTED_REPORT_MESSAGE = "Report is corrupted"
+    # Files which are not fields but are read by the checker
+    SERVICE_FILES = ("no-check-self", "runmode")
+    REPORT_POLL_INTERVAL = 0.2 # s
+    # Folders of TRIK Studio binaries in the checker root, they are a part of the checker version
+    CHECKER_BINARY_FOLDERS = ("bin", "lib")
+
+    # Spool folders of the daemon mode: new solutions, the solution being checked, results
+    INCOMING_FOLDER = "incoming"
+    PROCESSING_FOLDER = "processing"
+    RESULTS_FOLDER = "results"
+    SOLUTION_EXTENSION = ".js"
+    SPOOL_POLL_INTERVAL = 0.5 # s
+
+    def __init__(self, shard_number=1, checker_path=CHECKER_PATH, field_path=DEST_FIELD_PATH,
+                 solution_file_name=SOLUTION_FILE_NAME, project_file_name=PROJECT_FILE_NAME,
+                 report_file_path=REPORT_FILE_PATH, fail_fast=False, result_cache=None,
+                 fields_source=None, checker_version=None):
         '''
-        Initializes new instance of SolutionTester()
+        Initializes new instance of SolutionTester() which runs
+        shard_number checker processes concurrently and stops them
+        after the first failed field if fail_fast is set.
+        Results stored in result_cache are not checked again, fields are
+        taken from fields_source (the checker field folder by default).
+        With either of them the fields to check are copied to per-shard
+        folders, the source folder is never changed
         '''
 
         self.test_number = 0
-                 
+        self.shard_number = max(1, shard_number)
+        self.fail_fast = fail_fast
+
+        # (report folder, report name) -> (modification time, report), filled while the checker runs
+        self.reports = {}
+        self.field_results = []
+        self._start_time = None
+        self._are_fields_split = False
+
+        # Field name -> cached result, field name -> result cache key
+        self.cached_results = {}
+        self._field_keys = {}
+        self._missing_field_number = 0
+
+        self.checker_path = checker_path
+        self.field_path = field_path
+        self.solution_file_name = solution_file_name
+        self.project_file_name = project_file_name
+        self.report_file_path = report_file_path
+        self.result_cache = result_cache
+        self.fields_source = fields_source
+        self.checker_version = checker_version
+        self._are_fields_staged = result_cache is not None or fields_source is not None
+
+    def _get_shard_name(self, shard):
+        '''
+        Returns the name of the checker project for the shard
+        '''
+
+        project_name = os.path.splitext(os.path.basename(self.project_file_name))[0]
+        return "{0}_shard{1}".format(project_name, shard)
+
+    def _get_shards(self):
+        '''
+        Returns (project file, report folder) for each checker process
+        '''
+
+        if self.shard_number == 1 and not self._are_fields_staged:
+            return [(self.project_file_name, self.report_file_path)]
+
+        shards = []
+        for shard in range(self.shard_number):
+            shard_name = self._get_shard_name(shard)
+            shards.append((
+                os.path.join(os.path.dirname(self.project_file_name), shard_name + ".qrs"),
+                os.path.join(os.path.dirname(self.report_file_path), shard_name)))
+
+        return shards
+
+    def _copy_fields(self, fields, source_path, destination_path):
+        '''
+        Copies the fields with their descriptions and the checker service files
+        '''
+
+        for service_file in self.SERVICE_FILES:
+            if os.path.exists(os.path.join(source_path, service_file)):
+                shutil.copy(os.path.join(source_path, service_file), destination_path)
+
+        for field in fields:
+            shutil.copy(os.path.join(source_path, field), destination_path)
+
+            field_description = os.path.splitext(field)[0] + ".txt"
+            if os.path.exists(os.path.join(source_path, field_description)):
+                shutil.copy(os.path.join(source_path, field_description), destination_path)
+
+    def _split_fields(self, fields, source_path):
+        '''
+        Distributes the fields among per-shard field folders,
+        the checker takes fields from the folder named after the project
+        '''
+
+        print("Copying {0} fields into {1} shard(s)...".format(len(fields), self.shard_number))
+
+        for shard in range(self.shard_number):
+            shard_name = self._get_shard_name(shard)
+
+            shard_project = os.path.join(os.path.dirname(self.project_file_name), shard_name + ".qrs")
+            shutil.copyfile(self.project_file_name, shard_project)
+
+            shard_field_path = os.path.join(os.path.dirname(self.field_path), shard_name)
+            shutil.rmtree(shard_field_path, ignore_errors=True)
+            os.makedirs(shard_field_path)
+
+            self._copy_fields(fields[shard::self.shard_number], source_path, shard_field_path)
+
+    def _get_checker_version(self):
+        '''
+        Returns the given checker version or the hash of the checker script, the project
+        and the TRIK Studio binaries, so the results are checked again after an update
+        '''
+
+        if self.checker_version is not None:
+            return self.checker_version
+
+        checker_root = os.path.dirname(os.path.dirname(os.path.abspath(self.checker_path)))
+        binary_folders = [os.path.join(checker_root, folder) for folder in self.CHECKER_BINARY_FOLDERS]
+
+        return ResultCache.get_file_hash(self.checker_path) + ResultCache.get_file_hash(self.project_file_name) + \
+            ResultCache.get_folder_fingerprint(binary_folders)
+
+    def _prepare_fields(self):
+        '''
+        Takes the results of the fields from the cache and stages the other fields for the checker,
+        returns the number of fields found
+        '''
+
+        source_path = self.fields_source if self.fields_source is not None else self.field_path
+        fields = sorted(name for name in os.listdir(source_path) if name.endswith(".xml"))
+        if not fields:
+            return 0
+
+        self.cached_results = {}
+        self._field_keys = {}
+        missing_fields = fields
+
+        if self.result_cache is not None:
+            solution_hash = ResultCache.get_file_hash(self.solution_file_name)
+            checker_version = self._get_checker_version()
+
+            missing_fields = []
+            for field in fields:
+                field_name = os.path.splitext(field)[0]
+                key = ResultCache.get_key(solution_hash,
+                                          ResultCache.get_file_hash(os.path.join(source_path, field)),
+                                          checker_version)
+                self._field_keys[field_name] = key
+
+                result = self.result_cache.get(key)
+                if result is None:
+                    missing_fields.append(field)
+                else:
+                    self.cached_results[field_name] = result
+
+            print("Cached results: {0}, fields to check: {1}".format(
+                len(self.cached_results), len(missing_fields)))
+
+        self._missing_field_number = len(missing_fields)
+
+        if self._are_fields_staged:
+            self._split_fields(missing_fields, source_path)
+        elif self.shard_number > 1 and not self._are_fields_split:
+            # All fields are checked every time, so they are split once
+            self._split_fields(fields, source_path)
+            self._are_fields_split = True
+
+        return len(fields)
+
+    def _start_checkers(self):
+        '''
+        Starts trikStudio-checker processes, each one in its own process group
+        '''
+
+        print("Running {0} checker(s): ".format(self.shard_number))
+        processes = []
+        self._start_time = time.time()
+        for project_file_name, report_file_path in self._get_shards():
+            # Reports are read while they appear, so old ones must not stay
+            shutil.rmtree(report_file_path, ignore_errors=True)
+            processes.append(Popen([self.checker_path,
+                                    project_file_name,
+                                    self.solution_file_name],
+                                   start_new_session=True))
+
+        return processes
+
+    def _stop_checkers(self, processes):
+        '''
+        Kills checker processes with all their children
+        '''
+
+        for process in processes:
+            if process.poll() is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+            process.wait()
+
+    def _read_new_reports(self, is_final):
+        '''
+        Parses reports which appeared since the last call and returns
+        (report, message) for each of them. Incomplete reports are left
+        for the next call unless is_final is set
+        '''
+
+        new_reports = []
+        for project_file_name, report_file_path in self._get_shards():
+            project_name = os.path.splitext(os.path.basename(project_file_name))[0]
+            if not os.path.isdir(report_file_path):
+                continue
+
+            for report in sorted(os.listdir(report_file_path)):
+                report_path = os.path.join(report_file_path, report)
+                if report == "_" + project_name or (report_file_path, report) in self.reports:
+                    continue
+
+                try:
+                    with open(report_path, "r") as report_file:
+                        content = json.load(report_file)
+                    message = content[0]["message"]
+                except (ValueError, IndexError, KeyError, TypeError):
+                    # Checker is still writing the report
+                    if not is_final:
+                        continue
+                    content = [{"level": "error", "message": self.CORRUPTED_REPORT_MESSAGE}]
+                    message = content[0]["message"]
+
+                self.reports[(report_file_path, report)] = (os.path.getmtime(report_path), content)
+                new_reports.append((report, message))
+
+        return new_reports
+
     def _run_checker(self):
-        ''' 
-        Runs trikStudio-checker process
-        '''
-        
-        print("Running checker: ")
-        run([self.CHECKER_PATH,  
-             self.PROJECT_FILE_NAME,
-             self.SOLUTION_FILE_NAME])
-        
+        '''
+        Runs trikStudio-checker processes and reads reports while they appear
+        '''
+
+        if self._missing_field_number == 0:
+            print("All results are cached")
+            return
+
+        if self.fail_fast and any(result["report"][0]["message"] != self.SUCCESS_MESSAGE
+                                  for result in self.cached_results.values()):
+            print("Cached results contain failed fields, checkers are not started")
+            return
+
+        processes = self._start_checkers()
+        try:
+            while True:
+                is_finished = all(process.poll() is not None for process in processes)
+
+                for report, message in self._read_new_reports(is_finished):
+                    print("Field {0}; Status: {1}".format(report, message))
+
+                    if self.fail_fast and message != self.SUCCESS_MESSAGE:
+                        print("Field {0} failed, stopping checkers".format(report))
+                        self._stop_checkers(processes)
+                        return
+
+                if is_finished:
+                    return
+
+                time.sleep(self.REPORT_POLL_INTERVAL)
+        except BaseException:
+            # Checkers must not outlive an interrupted or failed run
+            self._stop_checkers(processes)
+            raise
+
+    @staticmethod
+    def _get_simulated_time(report):
+        '''
+        Returns the simulated time in seconds reported by the checker or None
+        '''
+
+        for entry in report:
+            if isinstance(entry, dict) and isinstance(entry.get("time"), (int, float)):
+                return entry["time"] / 1000
+
+        return None
+
+    def _collect_field_results(self):
+        '''
+        Builds the per-field results. A checker handles its fields one by one,
+        so the wall time of a field is the gap between its report and the previous one
+        '''
+
+        self.field_results = []
+        for shard, (_, report_file_path) in enumerate(self._get_shards()):
+            shard_reports = sorted((modification_time, report, content)
+                                   for (folder, report), (modification_time, content) in self.reports.items()
+                                   if folder == report_file_path)
+
+            previous_time = self._start_time
+            for modification_time, report, content in shard_reports:
+                message = content[0]["message"]
+                wall_time = round(max(0.0, modification_time - previous_time), 3)
+                self.field_results.append({
+                    "field": report,
+                    "shard": shard,
+                    "status": "passed" if message == self.SUCCESS_MESSAGE else "failed",
+                    "message": message,
+                    "wall_time": wall_time,
+                    "simulated_time": self._get_simulated_time(content),
+                    "cached": False})
+                previous_time = max(previous_time, modification_time)
+
+                # Corrupted reports are not cached, the field is checked again next time
+                if report in self._field_keys and message != self.CORRUPTED_REPORT_MESSAGE:
+                    self.result_cache.put(self._field_keys[report], {"report": content, "wall_time": wall_time})
+
+        for field_name, result in self.cached_results.items():
+            message = result["report"][0]["message"]
+            self.field_results.append({
+                "field": field_name,
+                "shard": None,
+                "status": "passed" if message == self.SUCCESS_MESSAGE else "failed",
+                "message": message,
+                "wall_time": result["wall_time"],
+                "simulated_time": self._get_simulated_time(result["report"]),
+                "cached": True})
+
+        self.field_results.sort(key=lambda result: result["field"])
+
     def _interpret_results(self):
         '''
-        Reads checker reports and counts the number of successful tests
+        Counts the number of successful tests among the read reports
         '''
-        
+
         print("Interpreting test results...")
+        self._collect_field_results()
         successful_tests = 0
-        
-        all_reports = os.listdir(self.REPORT_FILE_PATH)
-        for report in all_reports:
-            print("Interpreting {0}".format(report))
-            if (report == "_randomizer"):
-                continue
 
-	    self.test_number += 1
-            
-            report_file = open(self.REPORT_FILE_PATH + "/" + report, "r")
-            report_deserialized = json.load(report_file)[0]
-        
-            print("Field {0}; Status: {1}".format(report, report_deserialized["message"]))
-            if (report_deserialized["message"] == "Задание выполнено!"):
+        for result in self.field_results:
+            self.test_number += 1
+            if (result["status"] == "passed"):
                 successful_tests += 1
-                
-            report_file.close()
-        
+
         return successful_tests
-    
-    def run(self):
+
+    def get_summary(self):
+        '''
+        Returns test totals with p50/p95/max of the wall and simulated time per field
+        '''
+
+        summary = {
+            "total": len(self.field_results),
+            "successful": sum(result["status"] == "passed" for result in self.field_results)}
+
+        for key in ("wall_time", "simulated_time"):
+            values = [result[key] for result in self.field_results if result[key] is not None]
+            summary[key] = {
+                "p50": get_percentile(values, 50),
+                "p95": get_percentile(values, 95),
+                "max": max(values) if values else None}
+
+        return summary
+
+    def get_results(self):
+        '''
+        Returns the summary and the per-field results of the last run
         '''
-        Runs test procedure
+
+        return {"summary": self.get_summary(), "fields": self.field_results}
+
+    def save_json_report(self, path):
         '''
-        
+        Saves the summary and the per-field results as JSON
+        '''
+
+        with open(path, "w") as report_file:
+            json.dump(self.get_results(), report_file, ensure_ascii=False, indent=4)
+
+    def save_junit_report(self, path):
+        '''
+        Saves the per-field results as JUnit XML, one test case per field
+        '''
+
+        project_name = os.path.splitext(os.path.basename(self.project_file_name))[0]
+        summary = self.get_summary()
+
+        suite = xml.Element("testsuite", {
+            "name": project_name,
+            "tests": str(summary["total"]),
+            "failures": str(summary["total"] - summary["successful"]),
+            "errors": "0",
+            "time": "{0:.3f}".format(sum(result["wall_time"] for result in self.field_results))})
+
+        for result in self.field_results:
+            case = xml.SubElement(suite, "testcase", {
+                "classname": project_name,
+                "name": result["field"],
+                "time": "{0:.3f}".format(result["wall_time"])})
+
+            if result["status"] != "passed":
+                xml.SubElement(case, "failure", {"message": result["message"]})
+
+            if result["simulated_time"] is not None:
+                properties = xml.SubElement(case, "properties")
+                xml.SubElement(properties, "property", {
+                    "name": "simulated_time",
+                    "value": str(result["simulated_time"])})
+
+        xml.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+    def run(self, solution_file_name=None):
+        '''
+        Runs test procedure for the solution (the one given to the constructor by default)
+        '''
+
         print("Beginning test process...")
-    
+
+        if solution_file_name is not None:
+            self.solution_file_name = solution_file_name
+
+        self.test_number = 0
+        self.reports = {}
+        self.field_results = []
+
+        if self._prepare_fields() == 0:
+            print("Fields not found!!! Stopping test proccess")
+            return 0
+
         self._run_checker()
         return self._interpret_results()
-    
 
-tester = SolutionTester()
-successful_tests = tester.run()
+    def serve(self, spool_path):
+        '''
+        Checks the solutions put to the spool folder one by one until interrupted,
+        the checker fields stay prepared between the solutions
+        '''
+
+        incoming_path, processing_path, results_path = (os.path.join(spool_path, folder) for folder in
+            (self.INCOMING_FOLDER, self.PROCESSING_FOLDER, self.RESULTS_FOLDER))
+        for path in (incoming_path, processing_path, results_path):
+            os.makedirs(path, exist_ok=True)
+
+        # Solutions interrupted by the previous stop are checked again
+        for name in os.listdir(processing_path):
+            os.replace(os.path.join(processing_path, name), os.path.join(incoming_path, name))
+
+        print("Waiting for solutions in {0}".format(incoming_path))
+        while True:
+            submissions = sorted((os.path.getmtime(os.path.join(incoming_path, name)), name)
+                                 for name in os.listdir(incoming_path)
+                                 if name.endswith(self.SOLUTION_EXTENSION) and not name.startswith("."))
+            if not submissions:
+                time.sleep(self.SPOOL_POLL_INTERVAL)
+                continue
+
+            name = submissions[0][1]
+            submission_id = name[:-len(self.SOLUTION_EXTENSION)]
+            solution_file_name = os.path.join(processing_path, name)
+            os.replace(os.path.join(incoming_path, name), solution_file_name)
+
+            print("Checking solution {0}".format(submission_id))
+            try:
+                self.run(os.path.abspath(solution_file_name))
+                results = self.get_results()
+            except Exception as error:
+                # The failure is reported to the submitter, the next solutions are still checked
+                print("Checking solution {0} failed: {1!r}".format(submission_id, error))
+                self.field_results = []
+                results = self.get_results()
+                results["error"] = repr(error)
+
+            results["solution"] = submission_id
+            write_json_atomically(os.path.join(results_path, submission_id + ".json"), results)
+
+            os.remove(solution_file_name)
+
+
+def write_json_atomically(path, data):
+    '''
+    Writes JSON so that readers never see a partially written file
+    '''
+
+    temporary_path = os.path.join(os.path.dirname(path), ".{0}.tmp".format(os.path.basename(path)))
+    with open(temporary_path, "w") as data_file:
+        json.dump(data, data_file, ensure_ascii=False, indent=4)
+    os.replace(temporary_path, path)
+
+
+def submit_solution(spool_path, solution_file_name, timeout=None):
+    '''
+    Puts the solution to the spool folder of the daemon and waits for the results,
+    returns None if the results are not ready in timeout seconds
+    '''
+
+    submission_id = uuid.uuid4().hex
+    incoming_path = os.path.join(spool_path, SolutionTester.INCOMING_FOLDER)
+    os.makedirs(incoming_path, exist_ok=True)
+
+    # Daemon skips the hidden files, so it never sees the solution partially copied
+    temporary_path = os.path.join(incoming_path, "." + submission_id)
+    shutil.copyfile(solution_file_name, temporary_path)
+    os.replace(temporary_path, os.path.join(incoming_path, submission_id + SolutionTester.SOLUTION_EXTENSION))
+
+    results_path = os.path.join(spool_path, SolutionTester.RESULTS_FOLDER, submission_id + ".json")
+    start_time = time.time()
+    while not os.path.exists(results_path):
+        if timeout is not None and time.time() - start_time > timeout:
+            return None
+        time.sleep(SolutionTester.SPOOL_POLL_INTERVAL)
+
+    with open(results_path, "r") as results_file:
+        results = json.load(results_file)
+    os.remove(results_path)
+
+    return results
+
+
+def get_percentile(values, percent):
+    '''
+    Returns the nearest-rank percentile of the values or None if there are no values
+    '''
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[rank - 1]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Checks the solution on the fields with trikStudio-checker")
+
+    parser.add_argument("--shards", type=int, default=1, metavar="N",
+                        help="number of checker processes running concurrently")
+    parser.add_argument("--checker", default=SolutionTester.CHECKER_PATH, help="checker script")
+    parser.add_argument("--fields", default=SolutionTester.DEST_FIELD_PATH, help="folder with the fields")
+    parser.add_argument("--solution", default=SolutionTester.SOLUTION_FILE_NAME, help="solution file")
+    parser.add_argument("--project", default=SolutionTester.PROJECT_FILE_NAME, help="checker project file")
+    parser.add_argument("--reports", default=SolutionTester.REPORT_FILE_PATH, help="folder with the reports")
+    parser.add_argument("--fail-fast", default=False, action="store_true",
+                        help="stop checking after the first failed field")
+    parser.add_argument("--json-report", metavar="PATH", help="save per-field results as JSON")
+    parser.add_argument("--junit-report", metavar="PATH", help="save per-field results as JUnit XML")
+    parser.add_argument("--cache", default=None, metavar="CACHE_PATH",
+                        help="folder of the result cache (results are not cached by default)")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="result cache size limit")
+    parser.add_argument("--no-cache", default=False, action="store_true",
+                        help="check all fields again even if --cache is given")
+    parser.add_argument("--checker-version", default=None, metavar="VERSION",
+                        help="checker version for the result cache (hash of the checker script by default)")
+    parser.add_argument("--fields-source", default=None, metavar="PATH",
+                        help="folder to take the fields from, only fields without cached results "
+                             "are copied to the checker field folder")
+    parser.add_argument("--daemon", default=False, action="store_true",
+                        help="check the solutions put to the spool folder until interrupted")
+    parser.add_argument("--submit", metavar="SOLUTION", help="send the solution to the daemon and wait for the results")
+    parser.add_argument("--spool", default="./spool", help="spool folder of the daemon")
+    parser.add_argument("--timeout", type=float, default=None, metavar="S",
+                        help="maximum time to wait for the daemon results")
+
+    return parser.parse_args(sys.argv[1:])
+
+
+def print_summary(summary):
+    print("Total tests: ", summary["total"])
+    print("Successful: ", summary["successful"])
+
+    for key, title in (("wall_time", "Wall time"), ("simulated_time", "Simulated time")):
+        if summary[key]["max"] is not None:
+            print("{0} per field, s: p50 {1}, p95 {2}, max {3}".format(
+                title, summary[key]["p50"], summary[key]["p95"], summary[key]["max"]))
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    if arguments.submit:
+        results = submit_solution(arguments.spool, arguments.submit, arguments.timeout)
+        if results is None:
+            print("No results from the daemon in {0} s".format(arguments.timeout))
+            exit(1)
+
+        if "error" in results:
+            print("Checking failed: {0}".format(results["error"]))
+
+        for result in results["fields"]:
+            print("Field {0}; Status: {1}".format(result["field"], result["message"]))
+        print_summary(results["summary"])
+
+        # No fields checked is a failure as well
+        if (results["summary"]["total"] == 0 or
+                results["summary"]["total"] != results["summary"]["successful"]):
+            exit(1)
+        exit(0)
+
+    result_cache = None
+    if arguments.cache is not None and not arguments.no_cache:
+        result_cache = ResultCache(arguments.cache, arguments.cache_size * 1024 * 1024)
+
+    tester = SolutionTester(arguments.shards, arguments.checker, arguments.fields,
+                            arguments.solution, arguments.project, arguments.reports,
+                            arguments.fail_fast, result_cache, arguments.fields_source,
+                            arguments.checker_version)
+
+    if arguments.daemon:
+        try:
+            tester.serve(arguments.spool)
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    successful_tests = tester.run()
+    print_summary(tester.get_summary())
 
-print("Total tests: ", tester.test_number)
-print("Successful: ", successful_tests)
+    if arguments.json_report:
+        tester.save_json_report(arguments.json_report)
+    if arguments.junit_report:
+        tester.save_junit_report(arguments.junit_report)
 
-if (tester.test_number != successful_tests):
-    exit(1)
\ No newline at end of file
+    if (tester.test_number == 0 or tester.test_number != successful_tests):
+        exit(1)
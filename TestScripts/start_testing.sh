@@ -1,7 +1,10 @@
 #/bin/bash
 
-apt update
-apt install python3 -y
+# Warm containers already have python
+if ! command -v python3 > /dev/null ; then
+    apt update
+    apt install python3 -y
+fi
 
 # Cleaning example tester fields and movings user's own fields instead (if exists)
 new_fields="/trikStudio-checker/launch_scripts/custom_fields"
@@ -17,6 +20,12 @@ else
     exit 1
 fi
 
+# Broken fields are rejected before spending checker time on them
+if ! python3 /trikStudio-checker/launch_scripts/field_validator.py $checker_fields ; then
+    echo "Invalid fields detected!!! Stopping test proccess"
+    exit 1
+fi
+
 # Generating some service files for the checker
 touch $checker_fields/"no-check-self"
 touch $checker_fields/"runmode"
@@ -29,5 +38,7 @@ for i in $( ls "$checker_fields" ); do
     touch $checker_fields/"${i%.*}.txt"
 done
 
-# Running checking proccess
-python3 /trikStudio-checker/launch_scripts/solution_tester.py
\ No newline at end of file
+# Running checking proccess, one checker per core, results are cached in the volume
+# (extra arguments, e.g. --daemon --spool PATH, are passed to the tester)
+python3 /trikStudio-checker/launch_scripts/solution_tester.py --shards "$(nproc)" \
+    --cache /trikStudio-checker/launch_scripts/result_cache "$@"
\ No newline at end of file